@@ -1,14 +1,14 @@
 from datetime import date, timedelta
 
-from django.contrib import admin, messages
+from django.contrib import admin
+from django.contrib.admin.views.main import ChangeList
 from django.utils import timezone
-from monthdelta import monthdelta, monthmod
+from monthdelta import monthdelta
 
 from workdays.utils import workhours, today, last_weekend
 
-from .models import (BudgetCustomField, Customfield, CustomfieldOption,
-                     JiraIssue, JiraUser, Worklog, WorklogReport,
-                     WorklogSummary, WorklogFrame)
+from .models import (Customfield, JiraIssue, SyncWatermark, Worklog, WorklogReport,
+                     WorklogSummary, WorklogFrame, user_dimension)
 
 from timing import Timing
 
@@ -24,8 +24,25 @@ class JiraAdmin(admin.ModelAdmin):
     def has_delete_permission(self, request, extra_context=None): return False
 
 
+class BudgetChangeList(ChangeList):
+    '''
+    Список с загрузкой бюджетов для всей страницы
+    '''
+    def get_results(self, request):
+        super().get_results(request)
+        self.model.prefetch_budgets(self.result_list)
+
+
+class BudgetAdminMixin:
+    '''
+    Вывод бюджетов в списке без запросов на каждую строку
+    '''
+    def get_changelist(self, request, **kwargs):
+        return BudgetChangeList
+
+
 @admin.register(JiraIssue)
-class JiraIssueAdmin(JiraAdmin):
+class JiraIssueAdmin(BudgetAdminMixin, JiraAdmin):
     '''
     Запросы Jira
     '''
@@ -36,7 +53,7 @@ class JiraIssueAdmin(JiraAdmin):
 
 
 @admin.register(Worklog)
-class WorklogAdmin(JiraAdmin):
+class WorklogAdmin(BudgetAdminMixin, JiraAdmin):
     '''
     Журнал работ
     '''
@@ -109,6 +126,42 @@ def get_slice_param(request):
         return None
 
 
+def sync_state():
+    '''
+    Состояние синхронизации локальной копии журнала работ, None - копия еще не загружена
+    '''
+    state = SyncWatermark.objects.filter(name=SyncWatermark.WORKLOG).first()
+    return state if state and state.watermark else None
+
+
+def worklog_source(qs):
+    '''
+    Запрос к журналу работ отчета: локальная копия (qs - запрос отчета к LocalWorklog)
+    или, до первой синхронизации локальной копии, журнал работ JIRA
+    '''
+    return qs if sync_state() else Worklog.objects.all()
+
+
+def load_worklogframe(qs, fromdate, todate):
+    '''
+    Журнал работ за период из локальной копии или, до ее синхронизации, из JIRA
+    '''
+    qs = worklog_source(qs).filter(startdate__range=(fromdate, todate))
+    if qs.model is Worklog:
+        return WorklogFrame().load(qs)
+    return WorklogFrame().load_local(qs)
+
+
+def sync_stat():
+    '''
+    Источник данных отчета и время последней синхронизации локальной копии журнала работ
+    '''
+    state = sync_state()
+    if not state:
+        return ', данные загружены из JIRA (локальная копия не синхронизирована)'
+    return f', данные JIRA на {timezone.localtime(state.synced):%d.%m.%Y %H:%M}'
+
+
 def calc_month_norma(month_list, stop_date=None):
     '''
     Рассчитать список норм времени (опционально - по сегоднящний день)
@@ -186,7 +239,7 @@ class BaseReportAdmin(JiraAdmin):
         parameter_name = 'year'
 
         def lookups(self, request, model_admin):
-            qs = model_admin.get_queryset(request).order_by('startdate').filter(
+            qs = worklog_source(model_admin.get_queryset(request)).order_by('startdate').filter(
                 startdate__year__gte=BaseReportAdmin.START_YEAR
             )
 
@@ -281,16 +334,9 @@ class WorklogSummaryAdmin(BaseReportAdmin):
             # сброс параметра, если выбран набор данных в прошлом
             stop_date = None
         
-        qs = self.get_queryset(request).filter(
-            startdate__range=(
-                month_list[0],
-                stop_date or last_date
-            )
-        )
-
         # загрузка и сохранение в request журнала работ за год
         # (оптимизация для предотвращения необходимости повторной загрузки фрейма в фильтрах)
-        worklogframe = WorklogFrame().load(qs)
+        worklogframe = load_worklogframe(self.get_queryset(request), month_list[0], stop_date or last_date)
         # ограничение набора данных только теми, по которым решал задачи пользователь
         if not request.user.has_perm('jiradata.view_all'):
             worklogframe = worklogframe.filter(author=request.user.username)
@@ -305,8 +351,7 @@ class WorklogSummaryAdmin(BaseReportAdmin):
         )
 
         try:
-            cl = response.context_data['cl']
-            qs = cl.queryset
+            response.context_data['cl']
         except (AttributeError, KeyError):
             return response
 
@@ -332,7 +377,7 @@ class WorklogSummaryAdmin(BaseReportAdmin):
         response.context_data['norma'] = month_norma
         response.context_data['slice'] = stop_date
         response.context_data['year'] = year
-        response.context_data['stat'] = f'{rows} строк обработано за {seconds:.2} c'
+        response.context_data['stat'] = f'{rows} строк обработано за {seconds:.2} c{sync_stat()}'
 
         return response
 
@@ -364,16 +409,9 @@ class WorklogReportAdmin(BaseReportAdmin):
             # сброс параметра, если выбран набор данных в прошлом
             stop_date = None
         
-        qs = self.get_queryset(request).filter(
-            startdate__range=(
-                month_list[0],
-                stop_date or last_date
-            )
-        )
-
         # загрузка и сохранение в request журнала работ за год
         # (оптимизация для предотвращения необходимости повторной загрузки фрейма в фильтрах)
-        worklogframe = WorklogFrame().load(qs)
+        worklogframe = load_worklogframe(self.get_queryset(request), month_list[0], stop_date or last_date)
         # ограничение набора данных только теми, по которым решал задачи пользователь
         if not request.user.has_perm('jiradata.view_all'):
             worklogframe = worklogframe.filter(author=request.user.username)
@@ -388,8 +426,7 @@ class WorklogReportAdmin(BaseReportAdmin):
         )
 
         try:
-            cl = response.context_data['cl']
-            qs = cl.queryset
+            response.context_data['cl']
         except (AttributeError, KeyError):
             return response
 
@@ -403,11 +440,11 @@ class WorklogReportAdmin(BaseReportAdmin):
         seconds = t.step()
         
         response.context_data['months'] = month_list
-        response.context_data['member'] = JiraUser.objects.filter(user_name=user).first()
+        response.context_data['member'] = user_dimension.names().get(user)
         response.context_data['summary'], response.context_data['total'] = worklogframe.aggr_month_budget(month_list, month_norma)
         response.context_data['norma'] = month_norma
         response.context_data['slice'] = stop_date
         response.context_data['year'] = year
-        response.context_data['stat'] = f'{rows} строк обработано за {seconds:.2} c'
+        response.context_data['stat'] = f'{rows} строк обработано за {seconds:.2} c{sync_stat()}'
 
         return response
@@ -0,0 +1,164 @@
+from datetime import datetime
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db import models as md
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+from monthdelta import monthdelta
+
+from jiradata.models import LocalWorklog, SyncWatermark, Worklog, budget_subquery
+
+
+def month_counts(qs):
+    '''
+    Число записей журнала работ по месяцам (в UTC)
+    '''
+    return dict(
+        qs.order_by().annotate(
+            month=TruncMonth('startdate', output_field=md.DateField(), tzinfo=timezone.utc)
+        ).values_list('month').annotate(md.Count('id'))
+    )
+
+
+def month_start(day):
+    '''
+    Начало месяца (в UTC)
+    '''
+    return datetime(day.year, day.month, 1, tzinfo=timezone.utc)
+
+
+def month_range(month):
+    '''
+    Границы месяца для фильтра по дате выполнения работ
+    '''
+    start = month_start(month)
+    return start, start + monthdelta(1)
+
+
+class Command(BaseCommand):
+    '''
+    Инкрементальная синхронизация локальной копии журнала работ JIRA
+    '''
+    help = 'Загружает измененные после предыдущей синхронизации записи журнала работ JIRA и удаляет удаленные'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Загрузить все записи без учета отметки синхронизации')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Число записей в пакете записи')
+        parser.add_argument('--full-check', action='store_true',
+                            help='Искать удаленные в JIRA записи за весь период, а не только за последние месяцы')
+        parser.add_argument('--check-months', type=int, default=3,
+                            help='Число предыдущих месяцев, в которых ищутся удаленные в JIRA записи')
+
+    def handle(self, *args, **options):
+        self.batch_size = options['batch_size']
+        self.counts = [0, 0, 0]
+        # самая ранняя дата выполнения работ среди загруженных записей
+        self.earliest = None
+
+        with transaction.atomic():
+            state, _ = SyncWatermark.objects.select_for_update().get_or_create(name=SyncWatermark.WORKLOG)
+            watermark = None if options['full'] else state.watermark
+
+            # записи, измененные с момента предыдущей синхронизации, в том числе по запросам
+            # с измененными полями (бюджет запроса не меняет дату изменения записи журнала)
+            qs = Worklog.objects.all()
+            if watermark:
+                qs = qs.filter(md.Q(updated__gte=watermark) | md.Q(issueid__updated__gte=watermark))
+            state.watermark = self._pull(qs, watermark)
+
+            # удаление в JIRA не оставляет следов в измененных записях: удаленные записи ищутся
+            # за месяцы загруженных изменений и заданное число предыдущих месяцев
+            since = None
+            if not options['full_check']:
+                since = month_start(timezone.now()) - monthdelta(options['check_months'])
+                if self.earliest:
+                    since = min(since, month_start(self.earliest))
+            self._remove_deleted(since)
+            state.save()
+
+        inserted, updated, deleted = self.counts
+        self.stdout.write(self.style.SUCCESS(
+            f'Журнал работ синхронизирован: добавлено {inserted}, обновлено {updated}, удалено {deleted}, '
+            f'изменения загружены по {state.watermark}'))
+
+    def _pull(self, qs, watermark):
+        '''
+        Загрузка записей журнала работ пакетами, возвращает новую отметку синхронизации
+        '''
+        rows = qs.order_by().annotate(
+            budget_str=budget_subquery(),
+            issue_updated=md.F('issueid__updated')
+        ).values_list('id', 'issueid', 'author', 'startdate', 'timeworked', 'updated', 'issue_updated', 'budget_str')
+
+        batch = []
+        for row in rows.iterator():
+            batch.append(row)
+            if self.earliest is None or row[3] < self.earliest:
+                self.earliest = row[3]
+            # отметка - последняя дата изменения записи журнала или запроса
+            for changed in row[5:7]:
+                if changed and (watermark is None or changed > watermark):
+                    watermark = changed
+            if len(batch) >= self.batch_size:
+                self._upsert(batch)
+                batch = []
+        self._upsert(batch)
+
+        return watermark
+
+    def _upsert(self, rows):
+        if not rows:
+            return
+
+        objs = []
+        for id, issue_id, author, startdate, timeworked, updated, issue_updated, budget_str in rows:
+            try:
+                budget_id = float(budget_str)
+            except (TypeError, ValueError):
+                budget_id = None
+            objs.append(LocalWorklog(
+                id=int(id), issue_id=int(issue_id), author=author, startdate=startdate,
+                timeworked=int(timeworked or 0), updated=updated, budget_id=budget_id
+            ))
+
+        existing = set(LocalWorklog.objects.filter(id__in=[obj.id for obj in objs]).values_list('id', flat=True))
+        updated = [obj for obj in objs if obj.id in existing]
+        inserted = [obj for obj in objs if obj.id not in existing]
+
+        LocalWorklog.objects.bulk_update(
+            updated, ('issue_id', 'author', 'startdate', 'timeworked', 'updated', 'budget_id'))
+        LocalWorklog.objects.bulk_create(inserted)
+        self.counts[0] += len(inserted)
+        self.counts[1] += len(updated)
+
+    def _remove_deleted(self, since=None):
+        '''
+        Поиск удаленных в JIRA записей начиная с since (None - за весь период):
+        наборы id сравниваются только за месяцы с расхождением числа записей
+        '''
+        jira_qs, local_qs = Worklog.objects.all(), LocalWorklog.objects.all()
+        if since:
+            jira_qs, local_qs = jira_qs.filter(startdate__gte=since), local_qs.filter(startdate__gte=since)
+        jira_counts = month_counts(jira_qs)
+        local_counts = month_counts(local_qs)
+
+        for month in sorted(set(jira_counts) | set(local_counts)):
+            if jira_counts.get(month) == local_counts.get(month):
+                continue
+
+            bounds = month_range(month)
+            jira_ids = set(int(id) for id in Worklog.objects.filter(
+                startdate__gte=bounds[0], startdate__lt=bounds[1]).values_list('id', flat=True))
+            local_ids = set(LocalWorklog.objects.filter(
+                startdate__gte=bounds[0], startdate__lt=bounds[1]).values_list('id', flat=True))
+
+            deleted = list(local_ids - jira_ids)
+            for i in range(0, len(deleted), self.batch_size):
+                LocalWorklog.objects.filter(id__in=deleted[i:i + self.batch_size]).delete()
+            self.counts[2] += len(deleted)
+
+            # пропущенные записи (например, при загрузке прерванной синхронизации) догружаются по id
+            missing = list(jira_ids - local_ids)
+            for i in range(0, len(missing), self.batch_size):
+                self._pull(Worklog.objects.filter(id__in=missing[i:i + self.batch_size]), None)
@@ -0,0 +1,83 @@
+# Generated by Django 2.2.28 on 2026-10-18 03:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('jiradata', '0002_auto_20190126_1059'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LocalWorklog',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False, verbose_name='ID')),
+                ('issue_id', models.BigIntegerField(db_index=True, verbose_name='ID запроса')),
+                ('author', models.CharField(db_index=True, max_length=255, verbose_name='Создал')),
+                ('startdate', models.DateTimeField(db_index=True, verbose_name='Дата выполнения работ')),
+                ('timeworked', models.BigIntegerField(default=0, verbose_name='Затраченное время, c')),
+                ('updated', models.DateTimeField(verbose_name='Дата изменения')),
+                ('budget_id', models.FloatField(null=True, verbose_name='ID бюджета')),
+                ('budget', models.CharField(max_length=255, null=True, verbose_name='Бюджет проекта')),
+            ],
+            options={
+                'verbose_name': 'запись о работе (копия)',
+                'verbose_name_plural': 'записи о выполнении работ (копия)',
+                'default_permissions': ('view',),
+            },
+        ),
+        migrations.CreateModel(
+            name='SyncWatermark',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=60, unique=True, verbose_name='Набор данных')),
+                ('watermark', models.DateTimeField(null=True, verbose_name='Изменения загружены по')),
+                ('synced', models.DateTimeField(auto_now=True, verbose_name='Дата синхронизации')),
+            ],
+            options={
+                'verbose_name': 'отметка синхронизации',
+                'verbose_name_plural': 'отметки синхронизации',
+                'default_permissions': ('view',),
+            },
+        ),
+        # отчеты о фактической загрузке строятся по локальной копии журнала работ
+        migrations.DeleteModel(
+            name='WorklogSummary',
+        ),
+        migrations.CreateModel(
+            name='WorklogSummary',
+            fields=[
+            ],
+            options={
+                'verbose_name': 'фактическая загрузка по месяцам',
+                'verbose_name_plural': 'отчет о фактической загрузке по месяцам',
+                'permissions': (('view_all', 'Просмотр любого бюджета'),),
+                'proxy': True,
+                'default_permissions': ('view',),
+                'indexes': [],
+                'constraints': [],
+            },
+            bases=('jiradata.localworklog',),
+        ),
+        # отчеты о фактической загрузке строятся по локальной копии журнала работ
+        migrations.DeleteModel(
+            name='WorklogReport',
+        ),
+        migrations.CreateModel(
+            name='WorklogReport',
+            fields=[
+            ],
+            options={
+                'verbose_name': 'фактическая загрузка по сотруднику',
+                'verbose_name_plural': 'отчет о фактической загрузке по сотруднику',
+                'permissions': (('view_all', 'Просмотр любого сотрудника'),),
+                'proxy': True,
+                'default_permissions': ('view',),
+                'indexes': [],
+                'constraints': [],
+            },
+            bases=('jiradata.localworklog',),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 2.2.28 on 2026-10-18 04:18
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('jiradata', '0003_localworklog'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='localworklog',
+            name='budget',
+        ),
+    ]
@@ -1,12 +1,17 @@
 # pylint: disable=no-member
-from datetime import date, timedelta
+import hashlib
+import time
+from abc import ABC, abstractmethod
+from datetime import date
+from decimal import Decimal
 
 import pandas as pd
+from django.core.cache import cache
+from django.db import connections
 from django.db import models as md
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
 from django_pandas.io import read_frame
-from monthdelta import monthdelta, monthmod
-
-from timing import Timing
 
 
 class JiraModel(md.Model):
@@ -43,16 +48,51 @@ class BudgetCustomField:
         return self._issueid
 
     def budget_id_name(self):
+        # значение, загруженное для страницы списка или при предыдущем вызове
+        if hasattr(self, '_budget'):
+            return self._budget
+
         cfv = CustomfieldValue.objects.filter(
             issue=self.get_issueid(),
             customfield=BudgetCustomField.id
         ).first()
 
         # id и имя бюджета проекта
-        return (
+        self._budget = (
             cfv.value() if cfv else None,
             cfv.option_value() if cfv else None
         )
+        return self._budget
+
+    @classmethod
+    def prefetch_budgets(cls, objs):
+        '''
+        Загрузка id и имен бюджетов для набора объектов двумя запросами: значения поля и опции
+        '''
+        objs = list(objs)
+        issue_ids = set(obj.get_issueid() for obj in objs)
+
+        # первое значение поля бюджета каждого запроса, как при выборке first()
+        values = {}
+        for cfv in CustomfieldValue.objects.filter(
+                issue__in=issue_ids, customfield=BudgetCustomField.id).order_by('-id'):
+            values[cfv.issue] = cfv.value()
+
+        option_ids = set()
+        for value in values.values():
+            try:
+                option_ids.add(Decimal(str(value)))
+            except ArithmeticError:
+                pass
+        options = dict(CustomfieldOption.objects.filter(id__in=option_ids).values_list('id', 'customvalue'))
+
+        for obj in objs:
+            value = values.get(obj.get_issueid())
+            try:
+                option = options.get(Decimal(str(value)))
+            except ArithmeticError:
+                option = None
+            obj._budget = (value, (option or value) if value is not None else None)
 
     def budget_id(self):
         return self.budget_id_name()[0]
@@ -156,8 +196,8 @@ class Worklog(JiraModel, BudgetCustomField):
         return issue.summary
 
     def get_issueid(self):
-        # pylint: disable=no-member        
-        return self.issueid.id
+        # id запроса без загрузки самого запроса
+        return self.issueid_id
 
     def __str__(self):
         return f'{self.startdate:%d.%m.%Y} {self.author} {self.worklogbody or ""} {self.hours()} ч.'
@@ -212,7 +252,7 @@ class CustomfieldValue(JiraModel):
     def option_value(self):
         # возврат значения опции, если определена, иначе значения поля
         value = self.value()
-        option = CustomfieldOption.objects.filter(id=value).first().customvalue
+        option = CustomfieldOption.objects.filter(id=value).values_list('customvalue', flat=True).first()
         return option or value
 
     def __str__(self):
@@ -238,12 +278,65 @@ class CustomfieldOption(JiraModel):
     def __str__(self):
         return self.customvalue
 
+#
+# Локальная копия данных JIRA
+#
+
+
+class LocalWorklog(md.Model):
+    '''
+    Локальная копия журнала работ JIRA с бюджетами запросов для построения отчетов
+
+    Хранится в основной БД и обновляется командой sync_worklogs. Бюджет хранится только
+    идентификатором - названия берутся из справочника бюджетов при построении отчета
+    '''
+    class Meta():
+        verbose_name = 'запись о работе (копия)'
+        verbose_name_plural = 'записи о выполнении работ (копия)'
+        default_permissions = ('view',)
+
+    id = md.BigIntegerField('ID', primary_key=True)
+    issue_id = md.BigIntegerField('ID запроса', db_index=True)
+    author = md.CharField('Создал', max_length=255, db_index=True)
+    startdate = md.DateTimeField('Дата выполнения работ', db_index=True)
+    timeworked = md.BigIntegerField('Затраченное время, c', default=0)
+    updated = md.DateTimeField('Дата изменения')
+    budget_id = md.FloatField('ID бюджета', null=True)
+
+    def hours(self):
+        return self.timeworked / 3600
+    hours.short_description = 'Затраченное время, ч'
+
+    def __str__(self):
+        return f'{self.startdate:%d.%m.%Y} {self.author} {self.hours()} ч.'
+
+
+class SyncWatermark(md.Model):
+    '''
+    Отметка синхронизации локальной копии данных JIRA: время последнего изменения загруженных записей
+    '''
+    class Meta():
+        verbose_name = 'отметка синхронизации'
+        verbose_name_plural = 'отметки синхронизации'
+        default_permissions = ('view',)
+
+    # Наборы данных
+    WORKLOG = 'worklog'
+
+    name = md.CharField('Набор данных', max_length=60, unique=True)
+    watermark = md.DateTimeField('Изменения загружены по', null=True)
+    synced = md.DateTimeField('Дата синхронизации', auto_now=True)
+
+    def __str__(self):
+        return f'{self.name}: {self.watermark}'
+
+
 #
 # Модели отчетов
 #
 
 
-class WorklogSummary(Worklog):
+class WorklogSummary(LocalWorklog):
     ''' 
     Прокси-модель для сводного отчета о фактической загрузке
     '''
@@ -257,7 +350,7 @@ class WorklogSummary(Worklog):
         )
 
 
-class WorklogReport(Worklog):
+class WorklogReport(LocalWorklog):
     ''' 
     Прокси-модель для отчета о фактической загрузке сотрудника
     '''
@@ -299,58 +392,234 @@ class WorklogIssues(Worklog):
 #
 
   
-# получить фрейм названий бюджетов, индекс id запроса
-def df_issue_budget():
-    # перечень идентификаторов запросов с назначенными бюджетами 
-    df = read_frame(
-        CustomfieldValue.objects.filter(customfield=BudgetCustomField.id),
-        fieldnames=('stringvalue',),
-        index_col='issue',
-        coerce_float=True,
-        verbose=False
-    )
-    df['budget_id'] = df['stringvalue'].map(float)
-    del df['stringvalue']
-    # перечень всех названий бюджетов
-    opts = read_frame(
+# подзапрос строки id бюджета запроса для аннотации записей журнала работ
+def budget_subquery(issue_field='issueid'):
+    budget = CustomfieldValue.objects.filter(
+        issue=md.OuterRef(issue_field),
+        customfield=BudgetCustomField.id
+    ).values('stringvalue')[:1]
+    return md.Subquery(budget, output_field=md.CharField())
+
+
+# получить фрейм названий бюджетов, индекс id опции
+def df_budget_options():
+    return read_frame(
         CustomfieldOption.objects.filter(customfield=BudgetCustomField.id),
         fieldnames=('customvalue',),
         index_col='id',
         coerce_float=True,
         verbose=False
     ).rename(columns={'customvalue': 'budget'})
-    # исключение пробелов (отключено для выявления некорректных значений)
-    #opts['budget'] = opts['budget'].str.strip()
-    
-    return df.merge(opts, left_on='budget_id', right_index=True)
+
+
+class JiraDimension(ABC):
+    '''
+    Базовый класс кэша справочника JIRA
+
+    Данные хранятся в памяти процесса и в кэше Django (общем для рабочих процессов).
+    Актуальность проверяется по отпечатку таблиц справочника, отпечаток запрашивается
+    не чаще интервала проверки. Изменения, не затрагивающие отпечаток, 
+    отражаются по истечении срока хранения
+    '''
+    CACHE_KEY = None
+    # срок хранения данных, сек.
+    CACHE_TIMEOUT = 60 * 60
+    # интервал проверки отпечатка, сек.
+    CHECK_INTERVAL = 60
+
+    def __init__(self):
+        self._data = None
+        self._fingerprint = None
+        self._checked = 0
+        self._loaded = 0
+
+    @abstractmethod
+    def fingerprint(self):
+        '''
+        Отпечаток таблиц справочника
+        '''
+
+    @abstractmethod
+    def load(self):
+        '''
+        Загрузка данных справочника
+        '''
+
+    def _get(self):
+        now = time.monotonic()
+        if self._data is not None and now - self._checked < self.CHECK_INTERVAL:
+            return self._data
+        self._checked = now
+
+        fingerprint = self.fingerprint()
+        if self._data is not None and fingerprint == self._fingerprint and now - self._loaded < self.CACHE_TIMEOUT:
+            return self._data
+
+        # данные, загруженные другим процессом, используются при совпадении отпечатка
+        cached = cache.get(self.CACHE_KEY)
+        if cached and cached[0] == fingerprint:
+            data = cached[1]
+        else:
+            data = self.load()
+            cache.set(self.CACHE_KEY, (fingerprint, data), self.CACHE_TIMEOUT)
+
+        self._data, self._fingerprint, self._loaded = data, fingerprint, now
+        return data
+
+    def reset(self):
+        '''
+        Сброс кэша текущего процесса и общего кэша
+        '''
+        self._data = None
+        cache.delete(self.CACHE_KEY)
+
+
+class BudgetDimension(JiraDimension):
+    '''
+    Кэш справочника названий бюджетов (опций поля бюджета): id бюджета -> название бюджета
+
+    Отпечаток - контрольная сумма пар (id, название) опций поля бюджета: справочник небольшой,
+    поэтому добавление, удаление и переименование опций отражаются не позже интервала проверки.
+    Сопоставление запросов и бюджетов не кэшируется: бюджет запроса определяется
+    подзапросом budget_subquery при агрегации журнала работ на стороне БД
+    '''
+    CACHE_KEY = 'jiradata.budget.dimension'
+
+    def fingerprint(self):
+        checksum = hashlib.md5()
+        for id, name in CustomfieldOption.objects.filter(
+                customfield=BudgetCustomField.id).order_by('id').values_list('id', 'customvalue').iterator():
+            checksum.update(f'{id}\t{name}\n'.encode())
+        return checksum.hexdigest()
+
+    def load(self):
+        return df_budget_options()
+
+    def options(self):
+        '''
+        Фрейм названий бюджетов, индекс id опции
+        '''
+        return self._get()
+
+    def names(self):
+        '''
+        Словарь названий бюджетов по id опции
+        '''
+        return self.options()['budget'].to_dict()
+
+
+class UserDimension(JiraDimension):
+    '''
+    Кэш справочника пользователей JIRA: логин -> имя, признак активности
+
+    Отпечаток - число записей, максимальный id и дата изменения пользователей
+    '''
+    CACHE_KEY = 'jiradata.user.dimension'
+    CACHE_TIMEOUT = 15 * 60
+
+    def fingerprint(self):
+        return tuple(JiraUser.objects.aggregate(
+            count=md.Count('id'), max_id=md.Max('id'), updated=md.Max('updated_date')).values())
+
+    def load(self):
+        df = pd.DataFrame.from_records(
+            list(JiraUser.objects.values_list('user_name', 'first_name', 'last_name', 'active')),
+            columns=('user_name', 'first_name', 'last_name', 'active')
+        )
+        df['name'] = df['first_name'] + ' ' + df['last_name']
+        df['active'] = df['active'].astype(bool)
+        # логин может повторяться в разных каталогах пользователей - используется первая запись
+        return df.drop_duplicates('user_name').set_index('user_name')[['name', 'active']]
+
+    def frame(self):
+        '''
+        Фрейм имен и признаков активности, индекс логин пользователя
+        '''
+        return self._get()
+
+    def names(self):
+        '''
+        Имена пользователей, индекс логин пользователя
+        '''
+        return self.frame()['name']
+
+    def active(self):
+        '''
+        Признаки активности пользователей, индекс логин пользователя
+        '''
+        return self.frame()['active']
+
+
+budget_dimension = BudgetDimension()
+user_dimension = UserDimension()
 
 
 class WorklogFrame:
     '''
     Класс для анализа данных журнала работ с помощью pandas
     '''
+    # СУБД, в которых месяц работ вычисляется на стороне БД (TruncMonth с часовым поясом)
+    DATE_TRUNC_VENDORS = ('postgresql', 'mysql', 'oracle', 'sqlite')
+
     def __init__(self, df=pd.DataFrame()):
         self.df = df
 
-    # Загрузка фрейма из запроса с заданными колонками
+    # Загрузка фрейма из запроса: часы работ по пользователям, месяцам и бюджетам
     # возвращается копия объекта с загруженными данными
     def load(self, qs):
-        df = read_frame(
-            qs,
-            fieldnames=(
-                'author',
-                'startdate',
-                'timeworked'
-            ),
-            index_col='issueid',
-            coerce_float=True,
-            verbose=False
-        )
-        # обогащение id и названиями бюджетов
-        df = df.merge(df_issue_budget(), left_index=True, right_index=True)
-        
+        if connections[qs.db].vendor in WorklogFrame.DATE_TRUNC_VENDORS:
+            df = self._load_aggregated(qs)
+        else:
+            # СУБД не поддерживает усечение дат - агрегация в pandas по исходным записям
+            df = self._load_rows(qs)
+
         return WorklogFrame(df)
 
+    # Загрузка фрейма из запроса к локальной копии журнала работ (LocalWorklog):
+    # часы работ по пользователям, месяцам и бюджетам, агрегированные на стороне БД
+    # возвращается копия объекта с загруженными данными
+    def load_local(self, qs):
+        rows = qs.order_by().filter(budget_id__isnull=False).annotate(
+            month=TruncMonth('startdate', output_field=md.DateField(), tzinfo=timezone.utc)
+        ).values_list('author', 'month', 'budget_id').annotate(md.Sum('timeworked'))
+
+        df = pd.DataFrame.from_records(list(rows), columns=('author', 'month', 'budget_id', 'timeworked'))
+        df['timeworked'] = df['timeworked'].astype(float)
+
+        # названия бюджетов определяются на момент построения отчета, записи по удаленным опциям исключаются
+        return WorklogFrame(df.merge(budget_dimension.options(), left_on='budget_id', right_index=True))
+
+    # Агрегация журнала работ на стороне БД: GROUP BY пользователь, месяц, бюджет запроса
+    def _load_aggregated(self, qs):
+        rows = qs.order_by().annotate(
+            # месяц определяется по дате в UTC, как и при агрегации в pandas
+            month=TruncMonth('startdate', output_field=md.DateField(), tzinfo=timezone.utc),
+            budget_str=budget_subquery()
+        ).values_list('author', 'month', 'budget_str').annotate(md.Sum('timeworked'))
+
+        df = pd.DataFrame.from_records(list(rows), columns=('author', 'month', 'budget_id', 'timeworked'))
+        df['budget_id'] = pd.to_numeric(df['budget_id'], errors='coerce')
+        df['timeworked'] = df['timeworked'].astype(float)
+
+        # обогащение названиями бюджетов, записи по запросам без бюджета исключаются
+        df = df.merge(budget_dimension.options(), left_on='budget_id', right_index=True)
+
+        # повторное суммирование на случай разных строковых записей одного id бюджета
+        return df.groupby(['author', 'month', 'budget_id', 'budget'], as_index=False)['timeworked'].sum()
+
+    # Загрузка исходных записей журнала работ с обогащением бюджетами
+    def _load_rows(self, qs):
+        rows = qs.order_by().annotate(
+            budget_str=budget_subquery()
+        ).values_list('author', 'startdate', 'timeworked', 'budget_str')
+
+        df = pd.DataFrame.from_records(list(rows), columns=('author', 'startdate', 'timeworked', 'budget_id'))
+        df['budget_id'] = pd.to_numeric(df['budget_id'], errors='coerce')
+        df['timeworked'] = df['timeworked'].astype(float)
+
+        # обогащение названиями бюджетов, записи по запросам без бюджета исключаются
+        return df.merge(budget_dimension.options(), left_on='budget_id', right_index=True)
+
     # Фильтрация по заданному значению
     # возвращается копия объекта с отфильтрованнымми данными
     def filter(self, budget_id=None, author=None):
@@ -366,10 +635,11 @@ class WorklogFrame:
     # должен быть выполнен перед агрегацией
     def _prepare(self, month_list=None, month_norma=None):
         df = self.df
-        # расчет статистик
-        df['month'] = df['startdate'].map(lambda x: date(year=x.year, month=x.month, day=1))
+        # расчет статистик (при агрегации в БД месяц уже рассчитан)
+        if 'startdate' in df.columns:
+            df['month'] = df['startdate'].map(lambda x: date(year=x.year, month=x.month, day=1))
+            del df['startdate']
         df['hours'] = df['timeworked'] / 3600
-        del df['startdate']
         del df['timeworked']
         
         # если переданы нормы рабочего времени по месяцам
@@ -383,21 +653,14 @@ class WorklogFrame:
 
     # Обогащение реальными именами пользователей  
     def _add_name(self):
-        userdf = read_frame(
-            JiraUser.objects.all(),
-            fieldnames=(
-                'first_name',
-                'last_name'
-            ),
-            index_col='user_name'
-        )
-        userdf['name'] = userdf['first_name'] + ' ' + userdf['last_name']
-        self.df = self.df.merge(userdf, left_on='author', right_index=True)
+        # имена подставляются по категориям логинов, записи неизвестных пользователей исключаются
+        names = self.df['author'].astype('category').map(user_dimension.names()).astype(object)
+        self.df = self.df.assign(name=names)[names.notnull()]
     
     # Агрегация по месяцам и пользователям
     def aggr_month_user(self, month_list, month_norma=None):
         # расчет статистик
-        if 'month' not in self.df.columns:
+        if 'hours' not in self.df.columns:
             self._prepare(month_list, month_norma)
 
         # добавление имен пользователей    
@@ -422,7 +685,7 @@ class WorklogFrame:
     # Агрегация по месяцам и бюджетам
     def aggr_month_budget(self, month_list, month_norma=None):
         # расчет статистик
-        if 'month' not in self.df.columns:
+        if 'hours' not in self.df.columns:
             self._prepare(month_list, month_norma)
 
         # агрегирование по бюджетам и месяцам, получаем фрейм с иерархическим индексом: проект, месяц
@@ -1,3 +1,262 @@
+import io
+from datetime import date, datetime
+from unittest import mock
+
+from django.core.management import call_command
+from django.db import connections
 from django.test import TestCase
+from django.utils import timezone
+
+from .admin import worklog_source
+from .models import (BudgetCustomField, BudgetDimension, CustomfieldOption, CustomfieldValue, JiraIssue,
+                     JiraUser, LocalWorklog, SyncWatermark, UserDimension, Worklog, WorklogFrame,
+                     budget_dimension, user_dimension)
+
+JIRA_MODELS = (JiraIssue, Worklog, CustomfieldValue, CustomfieldOption, JiraUser)
+
+
+def moment(month, day, hour=12):
+    return datetime(2020, month, day, hour, tzinfo=timezone.utc)
+
+
+class JiraTestCase(TestCase):
+    '''
+    Тесты с таблицами JIRA в тестовой БД
+    '''
+    databases = {'default', 'jira'}
+
+    @classmethod
+    def setUpClass(cls):
+        # таблицы JIRA не управляются миграциями - создаются для тестовой БД до открытия транзакции теста
+        with connections['jira'].schema_editor() as editor:
+            for model in JIRA_MODELS:
+                editor.create_model(model)
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        with connections['jira'].schema_editor() as editor:
+            for model in JIRA_MODELS:
+                editor.delete_model(model)
+
+
+class WorklogTestCase(JiraTestCase):
+    '''
+    Журнал работ JIRA: запросы с бюджетами и без бюджета
+    '''
+    def setUp(self):
+        budget_dimension.reset()
+        for id, name in ((100, 'Бюджет A'), (101, 'Бюджет B')):
+            CustomfieldOption.objects.create(
+                id=id, customfield=BudgetCustomField.id, sequence=0, customvalue=name, optiontype='', disabled='N')
+        for id in (1, 2, 3):
+            JiraIssue.objects.create(
+                id=id, issuenum=id, project=1, reporter='u1', assignee='u1', creator='u1', summary=f'Запрос {id}',
+                description='', priority='', resolution='', issuestatus='', created=moment(1, 1), updated=moment(1, 1),
+                duedate=moment(12, 31), resolutiondate=moment(12, 31), timespent=0
+            )
+        # у запроса 3 бюджет не задан
+        self.budget_value(1, 100)
+        self.budget_value(2, 101)
+
+        self.worklog(1, 1, moment(1, 10))
+        self.worklog(2, 2, moment(1, 20))
+        self.worklog(3, 2, moment(2, 5))
+        self.worklog(4, 3, moment(2, 6))
+
+    def budget_value(self, issue_id, option_id):
+        CustomfieldValue.objects.update_or_create(
+            id=issue_id, defaults=dict(
+                issue=issue_id, customfield=BudgetCustomField.id, parentkey='', stringvalue=str(option_id),
+                numbervalue=0, textvalue='', datevalue=moment(1, 1), valuetype=''
+            )
+        )
+
+    def worklog(self, id, issue_id, startdate, updated=None, timeworked=3600, author='u1'):
+        Worklog.objects.create(
+            id=id, issueid_id=issue_id, author=author, worklogbody='', created=startdate, updateauthor=author,
+            updated=updated or startdate, startdate=startdate, timeworked=timeworked
+        )
+
+
+class SyncWorklogsTest(WorklogTestCase):
+
+    def sync(self, *args):
+        stdout = io.StringIO()
+        call_command('sync_worklogs', *args, stdout=stdout)
+        return stdout.getvalue()
+
+    def local_rows(self):
+        return {
+            wl.id: (wl.issue_id, wl.timeworked, wl.budget_id)
+            for wl in LocalWorklog.objects.all()
+        }
+
+    def test_initial_sync(self):
+        self.assertIn('добавлено 4, обновлено 0, удалено 0', self.sync())
+        self.assertEqual(self.local_rows(), {
+            1: (1, 3600, 100.0),
+            2: (2, 3600, 101.0),
+            3: (2, 3600, 101.0),
+            4: (3, 3600, None),
+        })
+        self.assertEqual(SyncWatermark.objects.get(name=SyncWatermark.WORKLOG).watermark, moment(2, 6))
+
+    def test_incremental_sync(self):
+        self.sync()
+
+        # измененная запись, новая запись, удаленная запись со старой датой изменения
+        Worklog.objects.filter(id=1).update(timeworked=7200, updated=moment(3, 1))
+        self.worklog(5, 1, moment(3, 2))
+        Worklog.objects.filter(id=2).delete()
+        # смена бюджета запроса не меняет даты изменения записей журнала
+        self.budget_value(2, 100)
+        JiraIssue.objects.filter(id=2).update(updated=moment(3, 3))
+
+        # записи с датой изменения, равной отметке, загружаются повторно (запись 4)
+        self.assertIn('добавлено 1, обновлено 3, удалено 1', self.sync())
+        self.assertEqual(self.local_rows(), {
+            1: (1, 7200, 100.0),
+            3: (2, 3600, 100.0),
+            4: (3, 3600, None),
+            5: (1, 3600, 100.0),
+        })
+        self.assertEqual(SyncWatermark.objects.get(name=SyncWatermark.WORKLOG).watermark, moment(3, 3))
+
+        # повторная синхронизация без изменений в JIRA: только записи запроса, измененного в момент отметки
+        self.assertIn('добавлено 0, обновлено 1, удалено 0', self.sync())
+        self.assertEqual(len(self.local_rows()), 4)
+
+    def test_missing_rows_restored(self):
+        self.sync()
+        LocalWorklog.objects.filter(id=3).delete()
+
+        self.assertIn('добавлено 1, обновлено 1, удалено 0', self.sync())
+        self.assertEqual(len(self.local_rows()), 4)
+
+    def test_deleted_check_window(self):
+        self.sync()
+
+        # удаление в месяце без загруженных изменений за пределами проверяемых последних месяцев
+        Worklog.objects.filter(id=1).delete()
+        self.assertIn('добавлено 0, обновлено 1, удалено 0', self.sync())
+        self.assertIn(1, self.local_rows())
+
+        self.assertIn('удалено 1', self.sync('--full-check'))
+        self.assertNotIn(1, self.local_rows())
+
+    def test_report_budget_names(self):
+        self.sync()
+        # переименование бюджета отражается в отчете без повторной синхронизации
+        CustomfieldOption.objects.filter(id=100).update(customvalue='Бюджет A1')
+        budget_dimension.reset()
+
+        df = WorklogFrame().load_local(LocalWorklog.objects.all()).df
+        self.assertEqual(
+            sorted(df[['budget_id', 'budget']].drop_duplicates().itertuples(index=False, name=None)),
+            [(100.0, 'Бюджет A1'), (101.0, 'Бюджет B')]
+        )
+        self.assertEqual(df['timeworked'].sum(), 3 * 3600)
+
+    def test_worklog_source(self):
+        # до первой синхронизации отчеты и фильтр по годам читают журнал работ JIRA
+        self.assertIs(worklog_source(LocalWorklog.objects.all()).model, Worklog)
+        self.sync()
+        self.assertIs(worklog_source(LocalWorklog.objects.all()).model, LocalWorklog)
+
+
+class WorklogFrameTest(WorklogTestCase):
+    def totals(self, df, key):
+        return df.groupby(key)['hours'].sum().to_dict()
+
+    def test_aggregated_matches_rows(self):
+        self.worklog(5, 1, moment(1, 31, 23), timeworked=1800, author='u2')
+        self.worklog(6, 2, moment(2, 1, 0), timeworked=5400, author='u2')
+        self.worklog(7, 1, moment(2, 29), timeworked=900, author='u2')
+
+        qs = Worklog.objects.all()
+        aggregated, rows = WorklogFrame(WorklogFrame()._load_aggregated(qs)), WorklogFrame(WorklogFrame()._load_rows(qs))
+        for frame in (aggregated, rows):
+            frame._prepare()
+
+        # записи по запросу без бюджета исключаются, месяц определяется по дате в UTC
+        self.assertEqual(self.totals(rows.df, 'month'), {
+            date(2020, 1, 1): 2.5, date(2020, 2, 1): 2.75
+        })
+        for key in ('month', 'author', 'budget', ['author', 'month', 'budget_id']):
+            with self.subTest(key=key):
+                self.assertEqual(self.totals(aggregated.df, key), self.totals(rows.df, key))
+
+
+class BudgetDimensionTest(JiraTestCase):
+    def setUp(self):
+        budget_dimension.reset()
+        CustomfieldOption.objects.create(
+            id=100, customfield=BudgetCustomField.id, sequence=0, customvalue='Бюджет A', optiontype='', disabled='N')
+
+    @mock.patch.object(BudgetDimension, 'CHECK_INTERVAL', 0)
+    def test_rename(self):
+        self.assertEqual(budget_dimension.names(), {100.0: 'Бюджет A'})
+        with self.assertNumQueries(1, using='jira'):
+            budget_dimension.names()
+
+        # переименование не меняет число и id опций, но меняет отпечаток
+        CustomfieldOption.objects.filter(id=100).update(customvalue='Бюджет A1')
+        self.assertEqual(budget_dimension.names(), {100.0: 'Бюджет A1'})
+
+
+class PrefetchBudgetsTest(WorklogTestCase):
+    def test_matches_budget_id_name(self):
+        # значение поля бюджета без опции (опция удалена)
+        JiraIssue.objects.create(
+            id=4, issuenum=4, project=1, reporter='u1', assignee='u1', creator='u1', summary='Запрос 4',
+            description='', priority='', resolution='', issuestatus='', created=moment(1, 1), updated=moment(1, 1),
+            duedate=moment(12, 31), resolutiondate=moment(12, 31), timespent=0
+        )
+        self.budget_value(4, 555)
+
+        expected = {issue.id: issue.budget_id_name() for issue in JiraIssue.objects.all()}
+        self.assertEqual(expected[4], ('555', '555'))
+        self.assertEqual(expected[3], (None, None))
+
+        issues = list(JiraIssue.objects.all())
+        with self.assertNumQueries(2, using='jira'):
+            JiraIssue.prefetch_budgets(issues)
+            prefetched = {issue.id: issue.budget_id_name() for issue in issues}
+        self.assertEqual(prefetched, expected)
+
+
+class UserDimensionTest(JiraTestCase):
+    def setUp(self):
+        user_dimension.reset()
+        self.user(1, 'u1', 'Иван', 'Иванов')
+        self.user(2, 'u2', 'Петр', 'Петров', active=0)
+
+    def user(self, id, login, first_name, last_name, active=1, directory_id=1):
+        JiraUser.objects.create(
+            id=id, directory_id=directory_id, user_name=login, active=active, created_date=moment(1, 1),
+            updated_date=moment(1, 1), first_name=first_name, last_name=last_name, email_address=f'{login}@example.com'
+        )
+
+    def test_names(self):
+        # логин из другого каталога пользователей не заменяет первую запись
+        self.user(3, 'u1', 'Иван', 'Другой', directory_id=2)
+        self.assertEqual(user_dimension.names().to_dict(), {'u1': 'Иван Иванов', 'u2': 'Петр Петров'})
+        self.assertEqual(user_dimension.active().to_dict(), {'u1': True, 'u2': False})
+
+    def test_cache_hit(self):
+        user_dimension.names()
+        # в пределах интервала проверки запросы к JIRA не выполняются
+        with self.assertNumQueries(0, using='jira'):
+            user_dimension.names()
+        # по истечении интервала проверяется только отпечаток
+        with mock.patch.object(UserDimension, 'CHECK_INTERVAL', 0):
+            with self.assertNumQueries(1, using='jira'):
+                user_dimension.names()
 
-# Create your tests here.
+    @mock.patch.object(UserDimension, 'CHECK_INTERVAL', 0)
+    def test_invalidation(self):
+        self.assertNotIn('u4', user_dimension.names())
+        self.user(4, 'u4', 'Сидор', 'Сидоров')
+        self.assertEqual(user_dimension.names()['u4'], 'Сидор Сидоров')
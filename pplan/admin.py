@@ -1,9 +1,12 @@
 from datetime import date
 
+from django import forms
 from django.contrib import admin
 from monthdelta import monthdelta, monthmod
 
-from .datautils import today, months
+from workdays.utils import finish_date_for_volume, workdays
+
+from .datautils import today, months, volume
 from .models import (Booking, Business, Division, Employee, 
                      MonthBookingSummary, MonthBookingEmployee,
                      Passport, Position, Project, ProjectBooking,
@@ -26,6 +29,10 @@ class DivisionAdmin(admin.ModelAdmin):
 
   #  inlines = [EmployeeInline]
     list_display = ('name', 'full_name', 'head', 'occupied')
+    list_select_related = ('head',)
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).with_occupied()
 
 
 @admin.register(Position)
@@ -35,6 +42,9 @@ class PositionAdmin(admin.ModelAdmin):
     '''
     list_display = ('name', 'occupied')
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).with_occupied()
+
 
 @admin.register(StaffingTable)
 class StaffingTableAdmin(admin.ModelAdmin):
@@ -43,6 +53,10 @@ class StaffingTableAdmin(admin.ModelAdmin):
     '''
     list_display = ('division', 'position', 'count', 'occupied', 'vacant')
     list_filter = ('division__name', 'position__name')
+    list_select_related = ('division', 'position')
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).with_occupied()
 
 
 class ProjectMemberInline(admin.TabularInline):
@@ -89,6 +103,10 @@ class EmployeeAdmin(admin.ModelAdmin):
                     'salary', 'hire_date', 'fire_date', 'is_3d')
     list_filter = ('division__name', 'position__name',
                    'is_3d', 'hire_date', 'fire_date')
+    list_select_related = ('division', 'position')
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).with_salary()
 
 
 @admin.register(Project)
@@ -100,6 +118,10 @@ class ProjectAdmin(admin.ModelAdmin):
     list_display = ('__str__', 'lead', 'member_count', 'volume_str',
                     'start_date', 'finish_date', 'state')
     list_filter = ('business__name', 'state', 'budget_state')
+    list_select_related = ('business',)
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).with_summary()
 
 
 @admin.register(Business)
@@ -124,7 +146,34 @@ class ProjectMemberAdmin(admin.ModelAdmin):
     Администрирование участников
     '''
     class BookingInline(admin.TabularInline):
+        # Форма с расчетом даты окончания загрузки по заданному объему работ
+        class BookingForm(forms.ModelForm):
+            class Meta():
+                model = Booking
+                fields = '__all__'
+
+            volume = forms.FloatField(label='Объем, чел.дн.', required=False, min_value=0)
+
+            def __init__(self, *args, **kwargs):
+                super().__init__(*args, **kwargs)
+                booking = self.instance
+                if booking.pk:
+                    self.initial['volume'] = volume(
+                        workdays(booking.start_date, booking.finish_date), booking.load)
+
+            def clean(self):
+                cleaned_data = super().clean()
+                # дата окончания пересчитывается только при изменении объема
+                if 'volume' in self.changed_data and cleaned_data.get('volume'):
+                    start = cleaned_data.get('start_date')
+                    finish = finish_date_for_volume(start, cleaned_data['volume'], cleaned_data.get('load')) if start else None
+                    if not finish:
+                        raise forms.ValidationError('Для расчета даты окончания по объему укажите начало и процент загрузки')
+                    cleaned_data['finish_date'] = finish
+                return cleaned_data
+
         model = Booking
+        form = BookingForm
         extra = 0
 
     inlines = [BookingInline]
@@ -132,11 +181,16 @@ class ProjectMemberAdmin(admin.ModelAdmin):
                     'finish_date', 'volume_str', 'percent_str', 'month_count', 'load_str')
     list_display_links = ('employee',)
     list_filter = ('project__short_name', 'role', 'project__state')
+    list_select_related = ('project__business', 'employee', 'role')
     # search_fields = (
     #    'employee__last_name', 'employee__first_name', 'employee__sur_name',
     #    'project__business__name','project__short_name', 'role__role')
     date_hierarchy = 'project__start_date'
 
+    def get_queryset(self, request):
+        # остальные показатели хранятся в полях участника, вычисляется только число месяцев
+        return super().get_queryset(request).with_month_count()
+
 
 class BaseBookingAdmin(admin.ModelAdmin):
     '''
@@ -184,9 +238,11 @@ class BaseBookingAdmin(admin.ModelAdmin):
     list_display_links = None
     list_filter = (YearFilter,)
     
-    # Данные месячной загрузки можно только смотреть или удалить (через связанный объект)
+    # Данные месячной загрузки рассчитываются автоматически, их можно только смотреть
+    # (удаление - только через связанный объект)
     def has_add_permission(self, request, extra_context=None): return False
     def has_change_permission(self, request, extra_context=None): return False
+    def has_delete_permission(self, request, extra_context=None): return False
 
 
 
@@ -199,10 +255,10 @@ class MonthBookingAdmin(BaseBookingAdmin):
 
     list_filter = (
         BaseBookingAdmin.YearFilter,
-        'booking__project_member__project__short_name',
-        'booking__project_member__role__role',
-        'booking__project_member__project__state',
-        'booking__project_member__project__budget_state'
+        'project_member__project__short_name',
+        'project_member__role__role',
+        'project_member__project__state',
+        'project_member__project__budget_state'
     )
     
     # Отображение списка сотрудников и месячной загруженности
@@ -232,7 +288,7 @@ class MonthBookingAdmin(BaseBookingAdmin):
         response.context_data['months'] = month_list
         response.context_data['summary'] = qs.get_booking(month_list)
         response.context_data['projects'] = sorted(set(qs.values_list(
-            'booking__project_member__project__short_name', flat=True)))
+            'project_member__project__short_name', flat=True)))
 
         return response
 
@@ -259,8 +315,8 @@ class ProjectBookingAdmin(BaseBookingAdmin):
     list_filter = (
         BaseBookingAdmin.YearFilter,
         MonthFilter,
-        'booking__project_member__project__state',
-        'booking__project_member__project__budget_state'
+        'project_member__project__state',
+        'project_member__project__budget_state'
     )
 
     # Отображение списка сотрудников и загруженности в проектах
@@ -295,7 +351,7 @@ class ProjectBookingAdmin(BaseBookingAdmin):
         # TODO: перенести в кастомный qs прокси-модели, упростить интерфейс get_booking
         qs = qs.filter(month__exact=month)
         projects = sorted(set(qs.values_list(
-            'booking__project_member__project__short_name', flat=True)))
+            'project_member__project__short_name', flat=True)))
 
         response.context_data['month'] = month
         response.context_data['summary'] = qs.get_booking(projects, month)
@@ -1,20 +1,66 @@
 from django.utils import timezone
 from datetime import timedelta
 
+import numpy as np
+
+# Число рабочих дней по производственному календарю (с учетом праздников и переносов)
+from workdays.utils import workdays, workdays_array
+
 def today():
     return timezone.now().date()
 
 def tomorrow():
     return today() + timedelta(days=1)
 
-# Число рабочих дней без учета праздников, список выходных задается третьим параметром (понедельник = 0)
-def workdays(fromdate, todate, weekend=(5,6)):
-    daygenerator = (fromdate + timedelta(x) for x in range((todate - fromdate).days + 1))
-    return sum(1 for day in daygenerator if day.weekday() not in weekend)
-
 # Объем работы в человекоднях при заданной продолжительности и проценте загрузки
-def volume(workdays, load):
-    return workdays * load / 100
+def volume(days, load):
+    return days * load / 100
+
+# Векторное разбиение загрузки по месяцам для массивов (списков) дат начала, окончания и процентов загрузки
+# результат - кортеж: 
+#   - массив месяцев (numpy.datetime64[M]) от первого месяца начала до последнего месяца окончания,
+#   - матрицы (записи загрузки x месяцы): рабочих дней, загрузки за месяц %, объема чел.дн.,
+#   - маска месяцев, в которых отражается загрузка
+def split_months_array(start_dates, finish_dates, loads):
+    starts = np.asarray(start_dates, dtype='datetime64[D]')
+    finishes = np.asarray(finish_dates, dtype='datetime64[D]')
+    loads = np.asarray(loads, dtype=float)[:, np.newaxis]
+    if not starts.size:
+        empty = np.zeros((0, 0))
+        return np.array([], dtype='datetime64[M]'), empty, empty, empty, empty.astype(bool)
+
+    # таблица границ месяцев: первые и последние числа, число рабочих дней
+    months = np.arange(starts.min().astype('datetime64[M]'), finishes.max().astype('datetime64[M]') + 1)
+    month_start = months.astype('datetime64[D]')
+    month_tail = (months + 1).astype('datetime64[D]') - 1
+    month_workdays = workdays_array(month_start, month_tail)
+
+    # границы загрузки внутри каждого месяца
+    start = np.maximum(starts[:, np.newaxis], month_start)
+    finish = np.minimum(finishes[:, np.newaxis], month_tail)
+    mask = start <= finish
+
+    days = workdays_array(start.ravel(), finish.ravel()).reshape(mask.shape)   # число запланированных рабочих дней в месяце
+    vol = volume(days, loads)                                                   # трудоемкость работ в месяце
+    month_load = days / month_workdays * loads                                  # нагрузка за месяц
+
+    return months, days, month_load, vol, mask
+
+# Разбиение по месяцам набора записей загрузки
+# результат - генератор кортежей: id записи, месяц, число рабочих дней, загрузка за месяц %, объем чел.дн.
+def split_bookings(booking_ids, start_dates, finish_dates, loads):
+    months, days, month_load, vol, mask = split_months_array(start_dates, finish_dates, loads)
+    rows, cols = np.nonzero(mask)
+    month_list = months.astype('datetime64[D]').astype(object)
+    booking_ids = np.asarray(booking_ids)
+
+    return zip(
+        booking_ids[rows].tolist(),
+        month_list[cols].tolist(),
+        days[mask].tolist(),
+        month_load[mask].tolist(),
+        vol[mask].tolist()
+    )
 
 def months():
     return (
@@ -0,0 +1,93 @@
+import multiprocessing
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+from django.utils.dateparse import parse_date
+
+from pplan.datautils import split_bookings
+from pplan.models import Booking, MonthBooking, ProjectMember, sync_member_month_booking
+from workdays.utils import production_calendar
+
+
+def split_chunk(chunk):
+    '''
+    Разбиение пакета записей загрузки по месяцам (выполняется в рабочем процессе)
+    '''
+    booking_ids = [row[0] for row in chunk]
+    month_bookings = [
+        MonthBooking(booking_id=booking_id, month=month, days=days, load=load, volume=vol)
+        for booking_id, month, days, load, vol in split_bookings(*zip(*chunk))
+    ]
+    return booking_ids, month_bookings
+
+
+class Command(BaseCommand):
+    '''
+    Полный пересчет данных о месячной загрузке
+    '''
+    help = 'Пересчитывает таблицу месячной загрузки по всем записям загрузки, по проекту или за период'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--project', action='append', help='Сокращенное название проекта (можно указать несколько)')
+        parser.add_argument('--from', dest='date_from', help='Начало периода, ГГГГ-ММ-ДД')
+        parser.add_argument('--to', dest='date_to', help='Окончание периода, ГГГГ-ММ-ДД')
+        parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Число рабочих процессов')
+        parser.add_argument('--batch-size', type=int, default=500, help='Число записей загрузки в пакете')
+
+    def handle(self, *args, **options):
+        qs = Booking.objects.all()
+        if options['project']:
+            qs = qs.filter(project_member__project__short_name__in=options['project'])
+        # записи загрузки, пересекающиеся с периодом
+        try:
+            if options['date_from']:
+                qs = qs.filter(finish_date__gte=parse_date(options['date_from']))
+            if options['date_to']:
+                qs = qs.filter(start_date__lte=parse_date(options['date_to']))
+        except (TypeError, ValueError):
+            raise CommandError('Даты периода должны быть указаны в формате ГГГГ-ММ-ДД')
+
+        rows = list(qs.order_by('id').values_list('id', 'start_date', 'finish_date', 'load'))
+        if not rows:
+            self.stdout.write('Нет записей загрузки для пересчета')
+            return
+
+        # индекс календаря строится заранее и наследуется рабочими процессами
+        production_calendar.index(min(r[1] for r in rows), max(r[2] for r in rows))
+
+        batch_size = options['batch_size']
+        chunks = [rows[i:i + batch_size] for i in range(0, len(rows), batch_size)]
+        workers = max(1, min(options['workers'] or 1, len(chunks)))
+
+        started = time.monotonic()
+        if workers > 1:
+            # соединения с БД не должны разделяться с дочерними процессами
+            connections.close_all()
+            with multiprocessing.get_context('fork').Pool(workers) as pool:
+                self._write(pool.imap_unordered(split_chunk, chunks), len(rows), started)
+        else:
+            self._write(map(split_chunk, chunks), len(rows), started)
+
+        # сводные данные участников по пересчитанной загрузке
+        members = ProjectMember.objects.filter(id__in=qs.values('project_member_id'))
+        sync_member_month_booking(members)
+        refreshed = members.refresh_summary()
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Пересчитано записей загрузки: {len(rows)} за {time.monotonic() - started:.1f} c, процессов: {workers}, '
+            f'обновлено участников: {refreshed}'))
+
+    def _write(self, results, total, started):
+        done = inserted = 0
+        for booking_ids, month_bookings in results:
+            with transaction.atomic():
+                MonthBooking.objects.filter(booking_id__in=booking_ids).delete()
+                MonthBooking.objects.bulk_create(month_bookings)
+
+            done += len(booking_ids)
+            inserted += len(month_bookings)
+            elapsed = time.monotonic() - started
+            self.stdout.write(
+                f'{done}/{total} записей загрузки, {inserted} записей по месяцам, {done / elapsed:.0f} зап./с')
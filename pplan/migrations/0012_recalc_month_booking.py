@@ -0,0 +1,77 @@
+from bisect import bisect_left, bisect_right
+from datetime import timedelta
+
+import numpy as np
+from django.db import migrations
+from monthdelta import monthdelta, monthmod
+
+# маска рабочих дней недели для numpy.busday_count на момент миграции
+# (с понедельника по воскресенье, 1 - рабочий день)
+WEEKMASK = '1111100'
+
+
+class MigrationCalendar:
+    '''
+    Производственный календарь по историческому состоянию модели SpecialDay
+    '''
+    def __init__(self, SpecialDay):
+        days = SpecialDay.objects.values_list('date', 'daytype')
+        self.holidays = sorted(day for day, daytype in days if daytype == 'HL')
+        # рабочие (в том числе сокращенные) дни, приходящиеся на выходные
+        self.weekend_workdays = sorted(
+            day for day, daytype in days if daytype != 'HL' and day.weekday() >= 5
+        )
+
+    def workdays(self, fromdate, todate):
+        if todate < fromdate:
+            return 0
+        count = np.busday_count(fromdate, todate + timedelta(1), weekmask=WEEKMASK, holidays=self.holidays)
+        return int(count) + bisect_right(self.weekend_workdays, todate) - bisect_left(self.weekend_workdays, fromdate)
+
+    def split_months(self, start_date, finish_date, load):
+        '''
+        Разбиение загрузки по месяцам: месяц, число рабочих дней, загрузка за месяц %, объем чел.дн.
+        '''
+        start_month = start_date.replace(day=1)
+        end_month = finish_date.replace(day=1)
+
+        for i in range(monthmod(start_month, end_month)[0].months + 1):
+            month = start_month + monthdelta(i)
+            monthtail = month + monthdelta(1) - timedelta(1)
+
+            start = month if start_date < month else start_date
+            finish = monthtail if finish_date > monthtail else finish_date
+
+            days = self.workdays(start, finish)
+            yield month, days, days / self.workdays(month, monthtail) * load, days * load / 100
+
+
+def recalc_month_booking(apps, schema_editor):
+    '''
+    Пересчет помесячной загрузки по производственному календарю
+    '''
+    Booking = apps.get_model('pplan', 'Booking')
+    MonthBooking = apps.get_model('pplan', 'MonthBooking')
+    calendar = MigrationCalendar(apps.get_model('workdays', 'SpecialDay'))
+
+    MonthBooking.objects.all().delete()
+    MonthBooking.objects.bulk_create(
+        (
+            MonthBooking(booking_id=booking.id, month=month, days=days, load=load, volume=vol)
+            for booking in Booking.objects.all().iterator()
+            for month, days, load, vol in calendar.split_months(booking.start_date, booking.finish_date, booking.load)
+        ),
+        batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pplan', '0011_auto_20181127_2239'),
+        ('workdays', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(recalc_month_booking, migrations.RunPython.noop),
+    ]
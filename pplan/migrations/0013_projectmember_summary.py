@@ -0,0 +1,56 @@
+# Generated by Django 2.2.28 on 2026-10-18 03:39
+
+from django.db import migrations, models
+
+
+def fill_member_summary(apps, schema_editor):
+    '''
+    Заполнение сводных данных участников проектов по плановой загрузке
+    '''
+    ProjectMember = apps.get_model('pplan', 'ProjectMember')
+
+    plan = models.Q(booking__state='PL')
+    members = ProjectMember.objects.order_by().annotate(
+        booking_start=models.Min('booking__start_date', filter=plan),
+        booking_finish=models.Max('booking__finish_date', filter=plan),
+        booking_volume=models.Sum('booking__monthbooking__volume', filter=plan),
+        booking_load=models.Avg('booking__monthbooking__load')
+    )
+    for member in members:
+        member.plan_start_date = member.booking_start
+        member.plan_finish_date = member.booking_finish
+        member.plan_volume = member.booking_volume or 0
+        member.plan_load = member.booking_load or 0
+    ProjectMember.objects.bulk_update(
+        members, ('plan_start_date', 'plan_finish_date', 'plan_volume', 'plan_load'), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pplan', '0012_recalc_month_booking'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='projectmember',
+            name='plan_finish_date',
+            field=models.DateField(editable=False, null=True, verbose_name='Дата окончания'),
+        ),
+        migrations.AddField(
+            model_name='projectmember',
+            name='plan_load',
+            field=models.FloatField(default=0, editable=False, verbose_name='Средн.мес., %'),
+        ),
+        migrations.AddField(
+            model_name='projectmember',
+            name='plan_start_date',
+            field=models.DateField(editable=False, null=True, verbose_name='Дата начала'),
+        ),
+        migrations.AddField(
+            model_name='projectmember',
+            name='plan_volume',
+            field=models.FloatField(default=0, editable=False, verbose_name='Объем, чел.дн'),
+        ),
+        migrations.RunPython(fill_member_summary, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,101 @@
+# Generated by Django 2.2.28 on 2026-10-18 03:43
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_member_month_booking(apps, schema_editor):
+    '''
+    Заполнение сводной загрузки участников проектов по месяцам
+    '''
+    MonthBooking = apps.get_model('pplan', 'MonthBooking')
+    MemberMonthBooking = apps.get_model('pplan', 'MemberMonthBooking')
+
+    totals = MonthBooking.objects.order_by().values_list('booking__project_member', 'month').annotate(
+        models.Sum('days'), models.Sum('load'), models.Sum('volume'))
+    MemberMonthBooking.objects.bulk_create(
+        (
+            MemberMonthBooking(project_member_id=member_id, month=month, days=days, load=load, volume=vol)
+            for member_id, month, days, load, vol in totals.iterator()
+        ),
+        batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pplan', '0013_projectmember_summary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MemberMonthBooking',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField(db_index=True, verbose_name='Месяц')),
+                ('days', models.IntegerField(verbose_name='Участие, дней')),
+                ('load', models.FloatField(default=0, verbose_name='Загрузка, %')),
+                ('volume', models.FloatField(default=0, verbose_name='Объем, чел.дн.')),
+                ('project_member', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='pplan.ProjectMember', verbose_name='Участник проекта')),
+            ],
+            options={
+                'verbose_name': 'загрузка участника проекта за месяц',
+                'verbose_name_plural': 'сводные данные загрузки участников проектов по месяцам',
+                'unique_together': {('project_member', 'month')},
+            },
+        ),
+        # отчеты о загрузке строятся по сводной таблице
+        migrations.DeleteModel(
+            name='MonthBookingSummary',
+        ),
+        migrations.CreateModel(
+            name='MonthBookingSummary',
+            fields=[
+            ],
+            options={
+                'verbose_name': 'загрузка по месяцам',
+                'verbose_name_plural': 'отчет о загрузке по месяцам',
+                'proxy': True,
+                'indexes': [],
+                'constraints': [],
+            },
+            bases=('pplan.membermonthbooking',),
+        ),
+        # отчеты о загрузке строятся по сводной таблице
+        migrations.DeleteModel(
+            name='ProjectBooking',
+        ),
+        migrations.CreateModel(
+            name='ProjectBooking',
+            fields=[
+            ],
+            options={
+                'verbose_name': 'загрузка по проектам',
+                'verbose_name_plural': 'отчет о загрузке по проектам',
+                'proxy': True,
+                'indexes': [],
+                'constraints': [],
+            },
+            bases=('pplan.membermonthbooking',),
+        ),
+        # отчеты о загрузке строятся по сводной таблице
+        migrations.DeleteModel(
+            name='MonthBookingEmployee',
+        ),
+        migrations.CreateModel(
+            name='MonthBookingEmployee',
+            fields=[
+            ],
+            options={
+                'verbose_name': 'загрузка по сотруднику',
+                'verbose_name_plural': 'отчет о загрузке по сотруднику',
+                'permissions': (('view_all', 'Просмотр любого сотрудника'),),
+                'proxy': True,
+                'indexes': [],
+                'constraints': [],
+            },
+            bases=('pplan.membermonthbooking',),
+        ),
+        migrations.RunPython(fill_member_month_booking, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,26 @@
+from django.db import migrations, models
+
+
+def recalc_plan_load(apps, schema_editor):
+    '''
+    Пересчет среднемесячной загрузки участников только по плановым записям загрузки
+    '''
+    ProjectMember = apps.get_model('pplan', 'ProjectMember')
+
+    members = ProjectMember.objects.order_by().annotate(
+        booking_load=models.Avg('booking__monthbooking__load', filter=models.Q(booking__state='PL'))
+    )
+    for member in members:
+        member.plan_load = member.booking_load or 0
+    ProjectMember.objects.bulk_update(members, ('plan_load',), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pplan', '0014_membermonthbooking'),
+    ]
+
+    operations = [
+        migrations.RunPython(recalc_plan_load, migrations.RunPython.noop),
+    ]
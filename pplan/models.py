@@ -1,25 +1,31 @@
 # pylint: disable=no-member
-from datetime import timedelta
-
-from django_pandas.io import read_frame
 
 from django.core.exceptions import ValidationError
 from django.core.validators import MaxValueValidator, MinValueValidator
 from django.db import models as md
-from django.db.models.signals import post_save
+from django.db import transaction
+from django.db.models.functions import Coalesce, Concat
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 from django.contrib.auth.models import User
-from django_pandas.io import read_frame
-from monthdelta import monthdelta, monthmod
 from phonenumber_field.modelfields import PhoneNumberField
 
-from .datautils import today, tomorrow, volume, workdays
+from .datautils import split_bookings, today, tomorrow, volume, workdays
 from .proxy_perm_create import proxy_perm_create
 
 import itertools as it
+import threading
+import weakref
+
+import pandas as pd
 
 # Create your models here.
 
+# Условие отбора работающих (не уволенных на текущую дату) сотрудников через связь prefix
+def working_filter(prefix=''):
+    return md.Q(**{f'{prefix}fire_date__isnull': True}) | md.Q(**{f'{prefix}fire_date__gte': today()})
+
+
 class Division(md.Model):
     '''
     Подразделение
@@ -33,11 +39,26 @@ class Division(md.Model):
     full_name = md.TextField('Полное название')
     head = md.OneToOneField('Employee', null=True, blank=True, on_delete=md.SET_NULL,
         verbose_name='Руководитель', related_name='headed')
-    
+
+    class QuerySet(md.QuerySet):
+        # Число работающих сотрудников подразделений одним запросом
+        def with_occupied(self):
+            return self.annotate(working_count=md.Count('employee', filter=working_filter('employee__')))
+
+    class Manager(md.Manager):
+        def get_queryset(self):
+            return Division.QuerySet(self.model, using=self._db)
+
+    # замена менеджера по умолчанию
+    objects = Manager()
+
     # pylint: disable=no-member
     def occupied(self):
+        if hasattr(self, 'working_count'):
+            return self.working_count
         return self.employee_set.exclude(fire_date__lt=today()).count()
         #return Employee.objects.filter(position__division__id=self.id).count()
+    occupied.admin_order_field = 'working_count'
     occupied.short_description = 'Работает сотрудников'
 
     def __str__(self):
@@ -54,11 +75,26 @@ class Position(md.Model):
 
     name = md.CharField('Наименование должности', max_length=200, unique=True)
 
+    class QuerySet(md.QuerySet):
+        # Число работающих сотрудников в должностях одним запросом
+        def with_occupied(self):
+            return self.annotate(working_count=md.Count('employee', filter=working_filter('employee__')))
+
+    class Manager(md.Manager):
+        def get_queryset(self):
+            return Position.QuerySet(self.model, using=self._db)
+
+    # замена менеджера по умолчанию
+    objects = Manager()
+
     # pylint: disable=no-member
     def occupied(self):
+        if hasattr(self, 'working_count'):
+            return self.working_count
         return self.employee_set.exclude(fire_date__lt=today()).count()
         # return Employee.objects.filter(position__position_name__id=self.id).count()
         # return sum(p.occupied() for p in self.position_set.all())   -- more slowly!
+    occupied.admin_order_field = 'working_count'
     occupied.short_description = 'Работает сотрудников'
 
     def __str__(self):
@@ -79,16 +115,43 @@ class StaffingTable(md.Model):
     position = md.ForeignKey(Position, on_delete=md.PROTECT, verbose_name='Должность')
     count = md.IntegerField('Число позиций', default=1, validators=[MinValueValidator(0)])       
 
+    class QuerySet(md.QuerySet):
+        # Число работающих сотрудников и вакансий по позициям одним запросом,
+        # exclude_employee - сотрудник, не учитываемый в занятых позициях (при проверке его самого)
+        def with_occupied(self, exclude_employee=None):
+            working = Employee.working.filter(
+                division_id=md.OuterRef('division_id'),
+                position_id=md.OuterRef('position_id')
+            ).exclude(
+                id=exclude_employee
+            ).order_by().values('division_id').annotate(count=md.Count('id')).values('count')
+
+            return self.annotate(
+                working_count=Coalesce(md.Subquery(working, output_field=md.IntegerField()), 0)
+            ).annotate(
+                vacant_count=md.F('count') - md.F('working_count')
+            )
+
+    class Manager(md.Manager):
+        def get_queryset(self):
+            return StaffingTable.QuerySet(self.model, using=self._db)
+
+    # замена менеджера по умолчанию
+    objects = Manager()
+
     # pylint: disable=no-member
     def occupied(self):
-        return Employee.working.filter(
-            division__name=self.division,
-            position__name=self.position
-            ).count()
+        if hasattr(self, 'working_count'):
+            return self.working_count
+        return Employee.working.filter(division_id=self.division_id, position_id=self.position_id).count()
+    occupied.admin_order_field = 'working_count'
     occupied.short_description = 'Работает сотрудников'
 
     def vacant(self):
+        if hasattr(self, 'vacant_count'):
+            return self.vacant_count
         return self.count - self.occupied()
+    vacant.admin_order_field = 'vacant_count'
     vacant.short_description = 'Вакансий'
 
     def __str__(self):
@@ -104,7 +167,31 @@ class Employee(md.Model):
         verbose_name_plural = 'сотрудники'
         ordering = ('last_name', 'first_name')
 
+    class QuerySet(md.QuerySet):
+        '''
+        Дополненный класс запроса сотрудников
+        '''
+        # Оклад сотрудников на дату (по умолчанию - последний установленный) одним запросом
+        def with_salary(self, on_date=None):
+            salary = Salary.objects.filter(employee=md.OuterRef('pk'))
+            if on_date:
+                salary = salary.filter(start_date__lte=on_date)
+            return self.annotate(
+                current_salary=md.Subquery(salary.order_by('-start_date').values('amount')[:1])
+            )
+
+        # Словарь ФИО сотрудников по id одним запросом (без создания объектов)
+        def names(self):
+            return {
+                id: f'{last_name} {first_name} {sur_name}'.rstrip()
+                for id, last_name, first_name, sur_name
+                in self.values_list('id', 'last_name', 'first_name', 'sur_name')
+            }
+
     class Manager(md.Manager):
+        def get_queryset(self):
+            return Employee.QuerySet(self.model, using=self._db)
+
         # поиск сотрудника по объекту пользователя
         def by_user(self, user):
             return self.filter(user__exact=user).first()
@@ -140,11 +227,14 @@ class Employee(md.Model):
     full_name.short_description = 'ФИО'
 
     def salary(self):
+        if hasattr(self, 'current_salary'):
+            return self.current_salary
         try:
             s = self.salary_set.latest().amount 
         except Salary.DoesNotExist: 
             s = None
         return s
+    salary.admin_order_field = 'current_salary'
     salary.short_description = 'Текущий оклад'
 
     def headed_division(self):
@@ -172,10 +262,10 @@ class Employee(md.Model):
         if self.position is None or self.division is None:
             return
         try:
-            table_position = StaffingTable.objects.get(division=self.division, position=self.position) 
-            # vacant positions + employee already in the same position > 0
-            if table_position.vacant() + Employee.objects.filter(
-                id=self.id, division=self.division, position=self.position).count() > 0:
+            # vacant positions, the employee being validated is not counted as occupying one
+            table_position = StaffingTable.objects.all().with_occupied(exclude_employee=self.id).get(
+                division=self.division, position=self.position)
+            if table_position.vacant() > 0:
                 return
             raise ValidationError(f'Для подразделения {self.division} все должности {self.position} уже заняты в штатном расписании.')
         except StaffingTable.DoesNotExist:
@@ -217,6 +307,45 @@ class Salary(md.Model):
     amount = md.IntegerField('Оклад', validators=[MinValueValidator(1)])
     start_date = md.DateField('Дата изменения')
 
+    class QuerySet(md.QuerySet):
+        '''
+        Дополненный класс запроса окладов
+        '''
+        # Оклады сотрудников на каждую дату ряда (например, на первые числа месяцев)
+        # одним запросом и векторным сопоставлением по последней дате изменения не позднее заданной
+        # результат - фрейм с полями: employee_id, date, amount, business_k
+        # (для дат ранее первого изменения оклада значения не заполнены)
+        def as_of(self, employee_ids, dates):
+            employee_ids = sorted(set(employee_ids))
+            dates = sorted(set(dates))
+            if not (employee_ids and dates):
+                return pd.DataFrame(columns=('employee_id', 'date', 'amount', 'business_k'))
+
+            salaries = pd.DataFrame.from_records(
+                self.filter(employee__in=employee_ids, start_date__lte=dates[-1]).values_list(
+                    'employee_id', 'start_date', 'amount', 'employee__business_k'),
+                columns=('employee_id', 'start_date', 'amount', 'business_k')
+            )
+            salaries['employee_id'] = salaries['employee_id'].astype('int64')
+            salaries['start_date'] = pd.to_datetime(salaries['start_date'])
+            salaries[['amount', 'business_k']] = salaries[['amount', 'business_k']].astype(float)
+
+            series = pd.DataFrame(list(it.product(employee_ids, dates)), columns=('employee_id', 'date'))
+            series['employee_id'] = series['employee_id'].astype('int64')
+            series['date'] = pd.to_datetime(series['date'])
+
+            return pd.merge_asof(
+                series.sort_values('date'), salaries.sort_values('start_date'),
+                left_on='date', right_on='start_date', by='employee_id'
+            ).drop(columns='start_date')
+
+    class Manager(md.Manager):
+        def get_queryset(self):
+            return Salary.QuerySet(self.model, using=self._db)
+
+    # замена менеджера по умолчанию
+    objects = Manager()
+
     def __str__(self):
         return f'{self.employee}, оклад: {self.amount} р., изменен {self.start_date:%d.%m.%Y}'
     
@@ -318,7 +447,44 @@ class Project(md.Model):
     budget_state = md.CharField('Состояние бюджета', max_length=2, 
                                 default=BUDGET_NONE, choices=BUDGET_STATE_CHOICES)
 
+    class QuerySet(md.QuerySet):
+        '''
+        Дополненный класс запроса проектов
+        '''
+        # Сводные данные по проектам одним запросом: руководитель, число участников, трудоемкость
+        def with_summary(self):
+            lead_name = ProjectMember.objects.filter(
+                project=md.OuterRef('pk'),
+                role__is_lead=True
+            ).annotate(
+                name=Concat(
+                    'employee__last_name', md.Value(' '),
+                    'employee__first_name', md.Value(' '),
+                    'employee__sur_name',
+                    output_field=md.CharField()
+                )
+            ).values('name')[:1]
+
+            return self.annotate(
+                lead_name=md.Subquery(lead_name, output_field=md.CharField()),
+                lead_count=md.Count('projectmember', filter=md.Q(projectmember__role__is_lead=True), distinct=True),
+                members=md.Count('projectmember', distinct=True),
+                volume_sum=md.Sum('projectmember__booking__monthbooking__volume')
+            )
+
+    class Manager(md.Manager):
+        def get_queryset(self):
+            return Project.QuerySet(self.model, using=self._db)
+
+    # замена менеджера по умолчанию
+    objects = Manager()
+
     def lead(self):
+        # значения из запроса with_summary(), если есть
+        if hasattr(self, 'lead_count'):
+            if self.lead_count > 1:
+                return 'Несколько руководителей?'
+            return self.lead_name.rstrip() if self.lead_count else 'Не указан'
         try:
             s = self.projectmember_set.get(role__is_lead=True).employee.full_name() 
         except ProjectMember.DoesNotExist:
@@ -330,6 +496,8 @@ class Project(md.Model):
 
     # трудозатраты в чел.дн. считаются из объема месячной загрузки всех участниклов проекта
     def volume(self):
+        if hasattr(self, 'volume_sum'):
+            return self.volume_sum or 0
         volume = MonthBooking.objects.filter(
             booking__project_member__project=self).aggregate(md.Sum('volume'))['volume__sum']
         return volume or 0
@@ -351,7 +519,10 @@ class Project(md.Model):
     month_volume_str.short_description = month_volume.short_description
 
     def member_count(self):
+        if hasattr(self, 'members'):
+            return self.members
         return self.projectmember_set.count()
+    member_count.admin_order_field = 'members'
     member_count.short_description = 'Участников'
 
     def __str__(self):
@@ -388,27 +559,79 @@ class ProjectMember(md.Model):
     project = md.ForeignKey(Project, on_delete=md.CASCADE, verbose_name='Проект')
     employee = md.ForeignKey(Employee, on_delete=md.CASCADE, verbose_name='Сотрудник')
     role = md.ForeignKey(Role, on_delete=md.PROTECT, verbose_name='Роль в проекте')
-    
+
+    # Сводные данные по плановой загрузке, обновляются автоматически, см. refresh_summary
+    plan_start_date = md.DateField('Дата начала', null=True, editable=False)
+    plan_finish_date = md.DateField('Дата окончания', null=True, editable=False)
+    plan_volume = md.FloatField('Объем, чел.дн', default=0, editable=False)
+    plan_load = md.FloatField('Средн.мес., %', default=0, editable=False)
+
+    class QuerySet(md.QuerySet):
+        '''
+        Дополненный класс запроса участников проекта
+        '''
+        # Показатели загрузки участников одним сгруппированным запросом по записям загрузки и месячной загрузке
+        def with_metrics(self):
+            plan = md.Q(booking__state=Booking.PLAN)
+            return self.annotate(
+                booking_start=md.Min('booking__start_date', filter=plan),
+                booking_finish=md.Max('booking__finish_date', filter=plan),
+                booking_volume=md.Sum('booking__monthbooking__volume', filter=plan),
+                booking_load=md.Avg('booking__monthbooking__load', filter=plan),
+                months=md.Count('booking__monthbooking__month', distinct=True)
+            )
+
+        # Число месяцев загрузки по сводной таблице MemberMonthBooking (без соединения с записями загрузки)
+        def with_month_count(self):
+            return self.annotate(months=md.Count('membermonthbooking'))
+
+        # Пересчет сводных данных по плановой загрузке, записываются только изменившиеся участники
+        def refresh_summary(self):
+            updated = []
+            for member in self.order_by().with_metrics():
+                summary = (member.booking_start, member.booking_finish,
+                           member.booking_volume or 0, member.booking_load or 0)
+                if summary != (member.plan_start_date, member.plan_finish_date, member.plan_volume, member.plan_load):
+                    member.plan_start_date, member.plan_finish_date, member.plan_volume, member.plan_load = summary
+                    updated.append(member)
+
+            ProjectMember.objects.bulk_update(
+                updated, ('plan_start_date', 'plan_finish_date', 'plan_volume', 'plan_load'))
+            return len(updated)
+
+    class Manager(md.Manager):
+        def get_queryset(self):
+            return ProjectMember.QuerySet(self.model, using=self._db)
+
+    # замена менеджера по умолчанию
+    objects = Manager()
+
     def start_date(self):
-        return self._start_date_for_state(Booking.PLAN)
+        return self.plan_start_date
+    start_date.admin_order_field = 'plan_start_date'
     start_date.short_description = 'Дата начала'
 
     def finish_date(self):
-        return self._finish_date_for_state(Booking.PLAN)
+        return self.plan_finish_date
+    finish_date.admin_order_field = 'plan_finish_date'
     finish_date.short_description = 'Дата окончания'
 
     def month_count(self):
+        if hasattr(self, 'months'):
+            return self.months
         # SqlLite do not support distinct on fields
         month_list = MonthBooking.objects.filter(booking__project_member=self).values_list('month', flat=True)
         return len(set(month_list))
+    month_count.admin_order_field = 'months'
     month_count.short_description = 'Месяцев'
 
     def volume(self):
-        return self._volume_for_state(Booking.PLAN)
+        return self.plan_volume
     volume.short_description = 'Объем, чел.дн'
 
     def volume_str(self):
         return f'{self.volume():n}'
+    volume_str.admin_order_field = 'plan_volume'
     volume_str.short_description = volume.short_description
 
     def percent(self):
@@ -426,13 +649,12 @@ class ProjectMember(md.Model):
         '''
         Среднемесячная загрузка
         '''
-        load = MonthBooking.objects.filter(
-            booking__project_member=self).aggregate(md.Avg('load'))['load__avg']
-        return load or 0
+        return self.plan_load
     load.short_description = 'Средн.мес., %'
 
     def load_str(self):
         return f'{self.load():n}'
+    load_str.admin_order_field = 'plan_load'
     load_str.short_description = load.short_description
 
     def __str__(self):
@@ -444,24 +666,6 @@ class ProjectMember(md.Model):
             load = ''
         return f'{self.project}, {self.employee}, {self.role}{load}'
 
-    def _start_date_for_state(self, state):
-        try:
-            s = Booking.objects.filter(project_member=self, state=state).order_by('start_date')[0].start_date
-        except IndexError:
-            s = None
-        return s
-
-    def _finish_date_for_state(self, state):
-        try:
-            s = Booking.objects.filter(project_member=self, state=state).order_by('-finish_date')[0].finish_date
-        except IndexError:
-            s = None
-        return s
-
-    def _volume_for_state(self, state):
-        booking = Booking.objects.filter(project_member=self, state=state)
-        return sum(volume(workdays(b.start_date, b.finish_date), b.load) for b in booking)
-        
 
 class Booking(md.Model):
     ''' 
@@ -542,6 +746,172 @@ class MonthBooking(md.Model):
         raise ValidationError('Данные месячной загрузки рассчитываются автоматически и\
         не могут быть добавлены или отредактированы вручную. Вернитесь к просмотру данных.')
 
+class MemberMonthBooking(md.Model):
+    '''
+    Сводная плановая загрузка участника проекта (сотрудник x проект) по месяцам
+
+    Данная модель заполняется автоматически по данным MonthBooking, см. sync_member_month_booking
+    '''
+    class Meta():
+        verbose_name = 'загрузка участника проекта за месяц'
+        verbose_name_plural = 'сводные данные загрузки участников проектов по месяцам'
+        unique_together = (('project_member', 'month'),)
+
+    project_member = md.ForeignKey(ProjectMember, on_delete=md.CASCADE, verbose_name='Участник проекта')
+    month = md.DateField('Месяц', db_index=True) # число месяца всегда должно быть == 1
+    days = md.IntegerField('Участие, дней')
+    load = md.FloatField('Загрузка, %', default=0)
+    volume = md.FloatField('Объем, чел.дн.', default=0)
+
+    def month_str(self):
+        return f'{self.month:%m.%Y}'
+    month_str.short_description = 'Месяц'
+
+    def __str__(self):
+        return f'{self.project_member_id}, месяц: {self.month_str()}: {self.days} дней, {self.load:n}%, {self.volume:n} чел.дн.'
+
+
+def sync_month_booking(bookings):
+    '''
+    Синхронизация данных о месячной загрузке в связанной таблице MonthBooking
+
+    Новые данные рассчитываются в памяти и сравниваются с существующими,
+    в базу записываются только изменения: вставка, обновление и удаление пакетами
+    '''
+    bookings = list(bookings)
+    if not bookings:
+        return
+
+    # существующие данные по месяцам
+    existing = {
+        (mb.booking_id, mb.month): mb
+        for mb in MonthBooking.objects.filter(booking__in=bookings)
+    }
+
+    created, updated = [], []
+    month_rows = split_bookings(
+        [b.id for b in bookings],
+        [b.start_date for b in bookings],
+        [b.finish_date for b in bookings],
+        [b.load for b in bookings]
+    )
+    for booking_id, month, days, load, vol in month_rows:
+        month_booking = existing.pop((booking_id, month), None)
+        if month_booking is None:
+            created.append(MonthBooking(booking_id=booking_id, month=month, days=days, load=load, volume=vol))
+        elif (month_booking.days, month_booking.load, month_booking.volume) != (days, load, vol):
+            month_booking.days, month_booking.load, month_booking.volume = days, load, vol
+            updated.append(month_booking)
+
+    if not (existing or updated or created):
+        return
+
+    # оставшиеся в словаре месяцы вне нового периода загрузки удаляются
+    with transaction.atomic():
+        if existing:
+            MonthBooking.objects.filter(id__in=[mb.id for mb in existing.values()]).delete()
+        if updated:
+            MonthBooking.objects.bulk_update(updated, ('days', 'load', 'volume'))
+        if created:
+            MonthBooking.objects.bulk_create(created)
+
+
+def sync_member_month_booking(members):
+    '''
+    Синхронизация сводной загрузки участников проектов по месяцам в таблице MemberMonthBooking
+
+    members - участники проектов (запрос или список id), для которых данные пересчитываются
+    суммированием MonthBooking по месяцам, в базу записываются только изменения
+    '''
+    totals = MonthBooking.objects.filter(booking__project_member__in=members).order_by().values_list(
+        'booking__project_member', 'month').annotate(md.Sum('days'), md.Sum('load'), md.Sum('volume'))
+
+    existing = {
+        (mb.project_member_id, mb.month): mb
+        for mb in MemberMonthBooking.objects.filter(project_member__in=members)
+    }
+
+    created, updated = [], []
+    for member_id, month, days, load, vol in totals:
+        month_booking = existing.pop((member_id, month), None)
+        if month_booking is None:
+            created.append(MemberMonthBooking(project_member_id=member_id, month=month, days=days, load=load, volume=vol))
+        elif (month_booking.days, month_booking.load, month_booking.volume) != (days, load, vol):
+            month_booking.days, month_booking.load, month_booking.volume = days, load, vol
+            updated.append(month_booking)
+
+    if not (existing or updated or created):
+        return
+
+    with transaction.atomic():
+        if existing:
+            MemberMonthBooking.objects.filter(id__in=[mb.id for mb in existing.values()]).delete()
+        if updated:
+            MemberMonthBooking.objects.bulk_update(updated, ('days', 'load', 'volume'))
+        if created:
+            MemberMonthBooking.objects.bulk_create(created)
+
+
+class MonthBookingBatch:
+    '''
+    Изменения загрузки одной транзакции, пересчитываемые после ее фиксации
+    '''
+    def __init__(self):
+        self.pending = set()
+        self.members = set()
+        self.done = False
+
+    def flush(self):
+        self.done = True
+        if not (self.pending or self.members):
+            return
+        # месячная загрузка, сводные данные и помесячные итоги участников изменяются согласованно
+        with transaction.atomic():
+            bookings = list(Booking.objects.filter(id__in=self.pending))
+            sync_month_booking(bookings)
+
+            # сводные данные участников пересчитываются после месячной загрузки
+            member_ids = self.members | set(b.project_member_id for b in bookings)
+            ProjectMember.objects.filter(id__in=member_ids).refresh_summary()
+            sync_member_month_booking(member_ids)
+
+
+class MonthBookingQueue(threading.local):
+    '''
+    Очередь пересчета месячной загрузки
+
+    Идентификаторы измененных записей загрузки накапливаются в пределах транзакции
+    без повторов и пересчитываются одним пакетом после ее фиксации
+    '''
+    def __init__(self):
+        self._batch = None
+
+    def add(self, booking_id):
+        self._enqueue(lambda batch: batch.pending.add(booking_id))
+
+    def add_member(self, member_id):
+        '''
+        Пересчет только сводных данных участника (например, после удаления записи загрузки)
+        '''
+        self._enqueue(lambda batch: batch.members.add(member_id))
+
+    def _enqueue(self, add):
+        # пакет удерживается только отложенным вызовом транзакции: при откате транзакции
+        # (точки сохранения) Django отбрасывает вызов, и пакет с отмененными изменениями освобождается
+        batch = self._batch() if self._batch else None
+        if batch is not None and not batch.done:
+            add(batch)
+            return
+        batch = MonthBookingBatch()
+        self._batch = weakref.ref(batch)
+        # вне транзакции пересчет выполняется при регистрации - пакет заполняется до нее
+        add(batch)
+        transaction.on_commit(batch.flush)
+
+
+month_booking_queue = MonthBookingQueue()
+
+
 @receiver(post_save, sender=Booking)
 def update_month_booking(sender, instance, **kwargs):
     '''
@@ -550,39 +920,19 @@ def update_month_booking(sender, instance, **kwargs):
     # disable the handler during fixture loading
     if kwargs['raw']:
         return
-        
-    # удаление старых данных
-    MonthBooking.objects.filter(booking=instance).delete()
-
-    # округление начального и конечного месяца участия в проекте до 1 числа
-    start_month = instance.start_date.replace(day=1)
-    end_month = instance.finish_date.replace(day=1)
-    
-    # месяцы, в которых нужно отразить нагрузку 
-    month_generator = (start_month + monthdelta(i) for i in range(monthmod(start_month, end_month)[0].months + 1))
 
-    for month in month_generator:
-        # последнее число месяца
-        monthtail = month + monthdelta(1) - timedelta(1)
+    month_booking_queue.add(instance.id)
 
-        start = month if instance.start_date < month else instance.start_date
-        finish = monthtail if instance.finish_date > monthtail else instance.finish_date
 
-        days = workdays(start, finish)                              # число запланированных рабочих дней в месяце 
-        vol = volume(days, instance.load)                           # трудоемкость работ в месяце
-        load = days / workdays(month, monthtail) * instance.load    # нагрузка за месяц
-
-        # заполнение таблицы помесячной загрузки
-        month_booking = MonthBooking(
-            booking=instance,
-            month=month,
-            days=days,
-            load=load,
-            volume=vol)
-        month_booking.save()
+@receiver(post_delete, sender=Booking)
+def update_member_summary(sender, instance, **kwargs):
+    '''
+    Обновление сводных данных участника проекта после удаления записи загрузки
+    '''
+    month_booking_queue.add_member(instance.project_member_id)
 
 
-class MonthBookingSummary(MonthBooking):
+class MonthBookingSummary(MemberMonthBooking):
     ''' 
     Прокси-модель для сводного отчета о загрузке сотрудников по месяцам
     '''
@@ -604,42 +954,34 @@ class MonthBookingSummary(MonthBooking):
         '''
         # Формирование набора данных по месяцам
         def get_booking(self, month_list):
-            # чтение запроса в фрейм
-            df = read_frame(
-                self,
-                fieldnames=[
-                    'booking__project_member__employee',
-                    'month',
-                    'load',
-                    'volume'
-                ]
+            # чтение запроса в фрейм, сотрудники - по id
+            df = pd.DataFrame.from_records(
+                self.values_list('project_member__employee_id', 'month', 'load'),
+                columns=('employee', 'month', 'load')
             )
             if df.empty: return []
 
-            # агрегирование по сотрудникам и месяцам, получаем фрейм с иерархическим индексом
-            month_booking = df.groupby(['booking__project_member__employee', 'month']).sum()
-
-            # результат - генератор последовательности словарей с полями: 
-            #   - сотрудник, 
-            #   - список помесячных записей о его загрузке для каждого месяца из переданного списка
-            #     (отсутствующие данные заполняются нулями)
-            return (
-                {
-                    'name': e,
-                    # сбрасываем индекс по сотруднику, переиндексируем по списку месяцев, выводим в список словарей
-                    'booking': booking.reset_index(level=0, drop=True).reindex(month_list, fill_value=0).to_dict('records')
-                    # это замена примерно следующего кода:
-                    # [
-                    #    {
-                    #        'load':booking.ix[e].load.get(month, 0),
-                    #        'volume':booking.ix[e].volume.get(month, 0)
-                    #    } for month in month_list
-                    # ]
-                } for e, booking in month_booking.groupby(level='booking__project_member__employee')
+            # сводная матрица загрузки: сотрудники x месяцы из переданного списка
+            # (отсутствующие данные заполняются нулями)
+            matrix = df.pivot_table(
+                index='employee', columns='month', values='load', aggfunc='sum', fill_value=0
+            ).reindex(columns=month_list, fill_value=0)
+            # pylint: disable=no-member
+            names = Employee.objects.filter(id__in=matrix.index.tolist()).names()
+
+            # результат - список словарей с полями, упорядоченный по сотрудникам:
+            #   - сотрудник,
+            #   - список значений загрузки по месяцам
+            return sorted(
+                (
+                    {'name': names[e], 'load': load}
+                    for e, load in zip(matrix.index.tolist(), matrix.values.tolist())
+                ),
+                key=lambda row: row['name']
             )
 
 
-class ProjectBooking(MonthBooking):
+class ProjectBooking(MemberMonthBooking):
     ''' 
     Прокси-модель для отчета о загрузке сотрудников по проектам
     '''
@@ -661,60 +1003,57 @@ class ProjectBooking(MonthBooking):
         '''
         # Формирование набора данных по проектам с возможностью вывода данных по выплатам за указанный месяц
         def get_booking(self, projects, salary_month=None):
-            # чтение запроса в фрейм
-            df = read_frame(
-                self,
-                fieldnames=[
-                    'booking__project_member__employee',
-                    'booking__project_member__project__short_name',
-                    'load',
-                    'volume',            
-                ],
-                index_col = 'booking__project_member__employee__id'
+            # чтение запроса в фрейм, сотрудники - по id
+            df = pd.DataFrame.from_records(
+                self.values_list('project_member__employee_id', 'project_member__project__short_name', 'load'),
+                columns=('employee', 'project', 'load')
             )
             if df.empty: return []
 
             if salary_month:
-                # чтение данных по з/п, выбор актуальных на заданный месяц
-                sdf = read_frame(
-                    # pylint: disable=no-member
-                    Salary.objects.filter(start_date__lte=salary_month),
-                    fieldnames=[
-                        'employee__id',
-                        'employee__business_k',
-                        'amount'
-                    ]
-                ).groupby(['employee__id']).first()
+                # оклады сотрудников, актуальные на заданный месяц
+                # pylint: disable=no-member
+                sdf = Salary.objects.all().as_of(df['employee'], [salary_month]).set_index('employee_id')
 
                 # обогащение набора данных и расчет оплаты в соответствии с загрузкой
-                df = df.join(sdf)
-                df['cost'] =  df['load'] * df['amount'] * df['employee__business_k'] / 100
-
-                # удаление ненужного столбца
-                del df['amount'], df['employee__business_k']
-
-            # агрегирование по сотрудникам и проектам, получаем фрейм с иерархическим индексом
-            project_booking = df.groupby([
-                'booking__project_member__employee', 
-                'booking__project_member__project__short_name']).sum()
-            
-            # результат - генератор последовательности словарей с полями: 
-            #   - сотрудник, 
-            #   - список записей о его загрузке для каждого проекта из переданного списка
-            #     (отсутствующие данные заполняются нулями),
-            #   - запись о суммарной загрузке
-            return (
-                {
-                    'name': e,
-                    # сбрасываем индекс по сотруднику, 
-                    # переиндексируем по списку проектов, выводим в список словарей
-                    'booking': booking.reset_index(level=0, drop=True).reindex(projects, fill_value=0).to_dict('records'),
-                    'total': booking.sum().to_dict()
-                } for e, booking in project_booking.groupby(level='booking__project_member__employee')
+                salary = sdf.reindex(df['employee'])
+                df['cost'] = df['load'].values * salary['amount'].values * salary['business_k'].values / 100
+            else:
+                df['cost'] = 0.0
+
+            # сводные матрицы загрузки и оплаты: сотрудники x проекты из переданного списка
+            # (отсутствующие данные заполняются нулями)
+            matrix = df.pivot_table(
+                index='employee', columns='project', values=['load', 'cost'], aggfunc='sum', fill_value=0
+            )
+            load = matrix['load'].reindex(columns=projects, fill_value=0)
+            cost = matrix['cost'].reindex(columns=projects, fill_value=0)
+            # pylint: disable=no-member
+            names = Employee.objects.filter(id__in=matrix.index.tolist()).names()
+
+            # результат - список словарей с полями, упорядоченный по сотрудникам:
+            #   - сотрудник,
+            #   - список пар (загрузка, оплата) по проектам,
+            #   - итоговая пара (загрузка, оплата)
+            return sorted(
+                (
+                    {
+                        'name': names[e],
+                        'booking': list(zip(load_row, cost_row)),
+                        'total': (load_total, cost_total)
+                    } for e, load_row, cost_row, load_total, cost_total in zip(
+                        matrix.index.tolist(),
+                        load.values.tolist(),
+                        cost.values.tolist(),
+                        matrix['load'].sum(axis=1).tolist(),
+                        matrix['cost'].sum(axis=1).tolist()
+                    )
+                ),
+                key=lambda row: row['name']
             )
 
 
-class MonthBookingEmployee(MonthBooking):
+class MonthBookingEmployee(MemberMonthBooking):
     ''' 
     Прокси-модель для отчета о загрузке выбранного сотрудника
     '''
@@ -742,40 +1081,31 @@ class MonthBookingEmployee(MonthBooking):
             # фильтрация запроса
             qs = self.filter(
                 month__range=(month_list[0], month_list[-1]), 
-                booking__project_member__employee__id=employee_id
+                project_member__employee_id=employee_id
             )
 
             # чтение запроса в фрейм
-            df = read_frame(
-                qs,
-                fieldnames=[
-                    'booking__project_member__project__short_name',
-                    'month',
-                    'load',
-                    'volume',            
-                ],
+            df = pd.DataFrame.from_records(
+                qs.values_list('project_member__project__short_name', 'month', 'load'),
+                columns=('project', 'month', 'load')
             )
             if df.empty: return [], None
 
-            # агрегирование по проектам и месяцам, получаем фрейм с иерархическим индексом: проект, месяц
-            month_booking = df.groupby(['booking__project_member__project__short_name', 'month']).sum()
+            # сводная матрица загрузки: проекты x месяцы из переданного списка
+            # (отсутствующие данные заполняются нулями)
+            matrix = df.pivot_table(
+                index='project', columns='month', values='load', aggfunc='sum', fill_value=0
+            ).reindex(columns=month_list, fill_value=0)
 
             # результат -- кортеж:
-            # 1) генератор последовательности словарей с полями: 
-            #   - проект, 
-            #   - список помесячных записей о загрузке для каждого месяца из переданного списка
-            #     (отсутствующие данные заполняются нулями)
-            # 2) итоговая строка 
+            # 1) список словарей с полями:
+            #   - проект,
+            #   - список значений загрузки по месяцам
+            # 2) итоговая строка - список суммарной загрузки по месяцам
             return (
-                (
-                    {
-                        'project': p,
-                        # сбрасываем индекс по проектам, переиндексируем по списку месяцев, выводим в список словарей
-                        'booking': booking.reset_index(level=0, drop=True).reindex(month_list, fill_value=0).to_dict('records')
-                    } for p, booking in month_booking.groupby(level='booking__project_member__project__short_name')
-                ),
-                {
-                    # дополнительная итоговая строка 
-                    'booking': month_booking.groupby('month').sum().reindex(month_list, fill_value=0).to_dict('records')
-                }
+                [
+                    {'project': p, 'load': load}
+                    for p, load in zip(matrix.index.tolist(), matrix.values.tolist())
+                ],
+                matrix.sum().tolist()
             )
@@ -1,3 +1,514 @@
-from django.test import TestCase
+import io
+from datetime import date, timedelta
+from unittest import mock
 
-# Create your tests here.
+import pandas as pd
+from django.core.management import call_command
+from django.db import transaction
+from django.test import TestCase, TransactionTestCase
+from monthdelta import monthdelta
+
+from workdays.utils import workdays
+
+from .datautils import split_bookings, today
+from .models import (Booking, Business, Division, Employee, MemberMonthBooking, MonthBooking,
+                     MonthBookingEmployee, MonthBookingSummary, Position, Project, ProjectBooking,
+                     ProjectMember, Role, Salary, StaffingTable, sync_member_month_booking,
+                     sync_month_booking)
+
+
+def create_member():
+    business = Business.objects.create(name='B', lead='Руководитель')
+    project = Project.objects.create(
+        business=business, short_name='P', full_name='Проект',
+        start_date=date(2030, 1, 1), finish_date=date(2030, 12, 31)
+    )
+    employee = Employee.objects.create(last_name='Иванов', first_name='Иван', hire_date=date(2020, 1, 1))
+    role = Role.objects.create(role='Разработчик')
+    return ProjectMember.objects.create(project=project, employee=employee, role=role)
+
+
+def split_months(start_date, finish_date, load):
+    '''
+    Эталонное разбиение загрузки по месяцам: обход месяцев периода
+    '''
+    month = start_date.replace(day=1)
+    while month <= finish_date:
+        monthtail = month + monthdelta(1) - timedelta(1)
+        days = workdays(max(start_date, month), min(finish_date, monthtail))
+        yield month, days, days / workdays(month, monthtail) * load, days * load / 100
+        month += monthdelta(1)
+
+
+class SplitBookingsTest(TestCase):
+    def test_matches_month_walk(self):
+        bookings = [
+            (1, date(2030, 1, 15), date(2030, 3, 10), 50),
+            (2, date(2030, 2, 1), date(2030, 2, 28), 100),
+            (3, date(2030, 2, 10), date(2030, 2, 10), 25),
+            (4, date(2029, 12, 30), date(2031, 1, 2), 10),
+            (5, date(2030, 6, 1), date(2030, 6, 2), 100),
+        ]
+        expected = [
+            (booking_id, ) + row
+            for booking_id, start, finish, load in bookings
+            for row in split_months(start, finish, load)
+        ]
+        actual = sorted(split_bookings(*zip(*bookings)))
+
+        self.assertEqual(len(actual), len(expected))
+        for row, expected_row in zip(actual, sorted(expected)):
+            self.assertEqual(row[:3], expected_row[:3])
+            self.assertAlmostEqual(row[3], expected_row[3])
+            self.assertAlmostEqual(row[4], expected_row[4])
+
+    def test_empty(self):
+        self.assertEqual(list(split_bookings([], [], [], [])), [])
+
+
+class SyncMonthBookingTest(TestCase):
+    def setUp(self):
+        self.booking = Booking.objects.create(
+            project_member=create_member(),
+            start_date=date(2030, 1, 15), finish_date=date(2030, 3, 10), load=50
+        )
+        MonthBooking.objects.all().delete()
+
+    def month_rows(self):
+        return {
+            mb.month: (mb.id, mb.days, mb.load, mb.volume)
+            for mb in MonthBooking.objects.filter(booking=self.booking)
+        }
+
+    def test_insert(self):
+        sync_month_booking([self.booking])
+        rows = self.month_rows()
+        self.assertEqual(sorted(rows), [date(2030, 1, 1), date(2030, 2, 1), date(2030, 3, 1)])
+        # январь 2030: 15-31 - 13 рабочих дней из 23
+        _, days, load, vol = rows[date(2030, 1, 1)]
+        self.assertEqual(days, 13)
+        self.assertAlmostEqual(load, 13 / 23 * 50)
+        self.assertAlmostEqual(vol, 6.5)
+
+    def test_update_and_delete(self):
+        sync_month_booking([self.booking])
+        before = self.month_rows()
+
+        # окончание переносится на февраль: март удаляется, февраль обновляется, январь не изменяется
+        self.booking.finish_date = date(2030, 2, 14)
+        sync_month_booking([self.booking])
+        after = self.month_rows()
+
+        self.assertEqual(sorted(after), [date(2030, 1, 1), date(2030, 2, 1)])
+        self.assertEqual(after[date(2030, 1, 1)], before[date(2030, 1, 1)])
+        self.assertEqual(after[date(2030, 2, 1)][0], before[date(2030, 2, 1)][0])
+        self.assertEqual(after[date(2030, 2, 1)][1], 10)
+
+        # новая загрузка обновляет существующие месяцы, расширение периода добавляет месяц
+        self.booking.load, self.booking.finish_date = 100, date(2030, 4, 1)
+        sync_month_booking([self.booking])
+        rows = self.month_rows()
+        self.assertEqual(len(rows), 4)
+        self.assertEqual(rows[date(2030, 1, 1)][0], before[date(2030, 1, 1)][0])
+        self.assertAlmostEqual(rows[date(2030, 1, 1)][3], 13)
+        self.assertEqual(rows[date(2030, 4, 1)][1], 1)
+
+    def test_unchanged(self):
+        sync_month_booking([self.booking])
+        before = self.month_rows()
+        with self.assertNumQueries(1):
+            sync_month_booking([self.booking])
+        self.assertEqual(self.month_rows(), before)
+
+
+class ProjectSummaryTest(TestCase):
+    def setUp(self):
+        member = create_member()
+        lead = Role.objects.create(role='Руководитель', is_lead=True)
+        employee = Employee.objects.create(
+            last_name='Петров', first_name='Петр', sur_name='Петрович', hire_date=date(2020, 1, 1))
+
+        # проект с руководителем и двумя участниками, проект с двумя руководителями, проект без участников
+        self.projects = [member.project]
+        ProjectMember.objects.create(project=member.project, employee=employee, role=lead)
+        project = Project.objects.create(
+            business=member.project.business, short_name='P2', full_name='Проект 2',
+            start_date=date(2030, 1, 1), finish_date=date(2030, 12, 31)
+        )
+        for person in (employee, member.employee):
+            ProjectMember.objects.create(project=project, employee=person, role=lead)
+        self.projects.append(project)
+        self.projects.append(Project.objects.create(
+            business=member.project.business, short_name='P3', full_name='Проект 3',
+            start_date=date(2030, 1, 1), finish_date=date(2030, 12, 31)
+        ))
+
+        sync_month_booking([
+            Booking.objects.create(project_member=pm, start_date=date(2030, 1, 15), finish_date=date(2030, 3, 10), load=load)
+            for pm, load in zip(ProjectMember.objects.order_by('id'), (50, 100, 30, 20))
+        ])
+
+    def summary(self, project):
+        return project.lead(), project.member_count(), project.volume()
+
+    def test_matches_methods(self):
+        expected = {project.id: self.summary(project) for project in Project.objects.all()}
+        actual = {project.id: self.summary(project) for project in Project.objects.all().with_summary()}
+
+        self.assertEqual(sorted(actual), sorted(expected))
+        for id, (lead, members, volume) in actual.items():
+            with self.subTest(project=id):
+                self.assertEqual((lead, members), expected[id][:2])
+                self.assertAlmostEqual(volume, expected[id][2])
+        self.assertEqual(
+            [actual[project.id][:2] for project in self.projects],
+            [('Петров Петр Петрович', 2), ('Несколько руководителей?', 2), ('Не указан', 0)]
+        )
+
+
+class OccupiedTest(TestCase):
+    def setUp(self):
+        divisions = [Division.objects.create(name=name, full_name=name) for name in ('D1', 'D2')]
+        positions = [Position.objects.create(name=name) for name in ('Инженер', 'Аналитик')]
+        for division in divisions:
+            for position in positions:
+                StaffingTable.objects.create(division=division, position=position, count=2)
+
+        # уволенный сотрудник не учитывается, увольнение в будущем - сотрудник еще работает
+        for i, (division, position, fire_date) in enumerate((
+                (0, 0, None), (0, 0, today() + timedelta(30)), (0, 1, today() - timedelta(1)),
+                (1, 0, None), (1, 1, None), (1, 1, None), (1, 1, None))):
+            self.last = Employee.objects.create(
+                last_name=f'Сотрудник {i}', first_name='И', hire_date=date(2020, 1, 1),
+                division=divisions[division], position=positions[position], fire_date=fire_date
+            )
+
+    def test_matches_methods(self):
+        for model in (Division, Position, StaffingTable):
+            with self.subTest(model=model.__name__):
+                expected = {obj.id: obj.occupied() for obj in model.objects.all()}
+                self.assertEqual({obj.id: obj.occupied() for obj in model.objects.all().with_occupied()}, expected)
+
+        expected = {obj.id: obj.vacant() for obj in StaffingTable.objects.all()}
+        self.assertEqual({obj.id: obj.vacant() for obj in StaffingTable.objects.all().with_occupied()}, expected)
+        self.assertEqual(sorted(expected.values()), [-1, 0, 1, 2])
+
+    def test_exclude_employee(self):
+        staffing = StaffingTable.objects.all().with_occupied(exclude_employee=self.last.id).get(
+            division=self.last.division, position=self.last.position)
+        self.assertEqual((staffing.occupied(), staffing.vacant()), (2, 0))
+
+
+class SalaryAsOfTest(TestCase):
+    dates = (date(2029, 12, 1), date(2030, 1, 1), date(2030, 3, 14), date(2030, 3, 15), date(2030, 4, 1))
+
+    def setUp(self):
+        self.employees = [
+            Employee.objects.create(last_name=f'Сотрудник {i}', first_name='И', hire_date=date(2020, 1, 1))
+            for i in range(3)
+        ]
+        # у третьего сотрудника оклад не задан
+        for employee, start_date, amount in (
+                (0, date(2030, 1, 1), 100), (0, date(2030, 3, 15), 200), (1, date(2030, 2, 1), 300)):
+            Salary.objects.create(employee=self.employees[employee], start_date=start_date, amount=amount)
+
+    def salary(self, employee, on_date=None):
+        # эталон: последнее изменение оклада не позднее даты
+        salary = Salary.objects.filter(employee=employee)
+        if on_date:
+            salary = salary.filter(start_date__lte=on_date)
+        salary = salary.order_by('-start_date').first()
+        return salary.amount if salary else None
+
+    def test_as_of(self):
+        df = Salary.objects.all().as_of([e.id for e in self.employees], self.dates)
+        actual = {
+            (row.employee_id, row.date.date()): None if pd.isna(row.amount) else row.amount
+            for row in df.itertuples()
+        }
+        self.assertEqual(actual, {
+            (employee.id, day): self.salary(employee, day)
+            for employee in self.employees for day in self.dates
+        })
+        # оклад, измененный в дату ряда, действует с этой даты
+        self.assertEqual(actual[self.employees[0].id, date(2030, 3, 14)], 100)
+        self.assertEqual(actual[self.employees[0].id, date(2030, 3, 15)], 200)
+        self.assertEqual(set(df['business_k'].dropna()), {0.5})
+
+    def test_as_of_empty(self):
+        self.assertTrue(Salary.objects.all().as_of([], self.dates).empty)
+
+    def test_with_salary(self):
+        for on_date in (None, ) + self.dates:
+            with self.subTest(on_date=on_date):
+                self.assertEqual(
+                    {e.id: e.current_salary for e in Employee.objects.all().with_salary(on_date)},
+                    {e.id: self.salary(e, on_date) for e in self.employees}
+                )
+
+
+class EmployeeNamesTest(TestCase):
+    def test_matches_full_name(self):
+        employees = [
+            Employee.objects.create(last_name='Иванов', first_name='Иван', sur_name=sur_name, hire_date=date(2020, 1, 1))
+            for sur_name in ('Иванович', '')
+        ]
+        with self.assertNumQueries(1):
+            names = Employee.objects.all().names()
+        self.assertEqual(names, {employee.id: employee.full_name() for employee in employees})
+        self.assertEqual(names[employees[1].id], 'Иванов Иван')
+        self.assertEqual(Employee.objects.filter(id=employees[0].id).names(), {employees[0].id: 'Иванов Иван Иванович'})
+
+
+class RefreshSummaryTest(TestCase):
+    def test_plan_only(self):
+        member = create_member()
+        bookings = [
+            Booking.objects.create(project_member=member, start_date=date(2030, 1, 1), finish_date=date(2030, 1, 31), load=100),
+            # записи загрузки с другим статусом не учитываются в плановых показателях
+            Booking.objects.create(project_member=member, start_date=date(2030, 2, 1), finish_date=date(2030, 3, 31),
+                                   load=20, state='FA'),
+        ]
+        sync_month_booking(bookings)
+        ProjectMember.objects.filter(id=member.id).refresh_summary()
+
+        member.refresh_from_db()
+        self.assertEqual((member.plan_start_date, member.plan_finish_date), (date(2030, 1, 1), date(2030, 1, 31)))
+        self.assertAlmostEqual(member.plan_volume, 23)
+        self.assertAlmostEqual(member.plan_load, 100)
+
+
+class RebuildMonthBookingTest(TestCase):
+    def test_matches_sync(self):
+        member = create_member()
+        bookings = [
+            Booking.objects.create(project_member=member, start_date=start, finish_date=finish, load=load)
+            for start, finish, load in (
+                (date(2030, 1, 15), date(2030, 3, 10), 50),
+                (date(2030, 2, 1), date(2030, 2, 28), 100),
+                (date(2029, 12, 30), date(2031, 1, 2), 10),
+            )
+        ]
+        MonthBooking.objects.all().delete()
+        MemberMonthBooking.objects.all().delete()
+
+        sync_month_booking(bookings)
+        sync_member_month_booking([member.id])
+        expected = self.month_rows()
+
+        MonthBooking.objects.all().delete()
+        MemberMonthBooking.objects.all().delete()
+        call_command('rebuild_month_booking', '--workers', '1', '--batch-size', '2', stdout=io.StringIO())
+
+        self.assertEqual(self.month_rows(), expected)
+        member.refresh_from_db()
+        self.assertEqual((member.plan_start_date, member.plan_finish_date), (date(2029, 12, 30), date(2031, 1, 2)))
+
+    def month_rows(self):
+        return (
+            sorted(MonthBooking.objects.values_list('booking', 'month', 'days', 'load', 'volume')),
+            sorted(MemberMonthBooking.objects.values_list('project_member', 'month', 'load', 'volume')),
+        )
+
+
+class SyncMemberMonthBookingTest(TestCase):
+    def setUp(self):
+        self.member = create_member()
+        self.other = ProjectMember.objects.create(
+            project=self.member.project, role=self.member.role,
+            employee=Employee.objects.create(last_name='Петров', first_name='Петр', hire_date=date(2020, 1, 1)))
+        self.bookings = [
+            Booking.objects.create(project_member=member, start_date=start, finish_date=finish, load=load)
+            for member, start, finish, load in (
+                (self.member, date(2030, 1, 15), date(2030, 3, 10), 50),
+                (self.member, date(2030, 2, 1), date(2030, 2, 28), 30),
+                (self.other, date(2030, 1, 1), date(2030, 1, 31), 100),
+            )
+        ]
+        sync_month_booking(self.bookings)
+
+    def member_rows(self, member):
+        return {
+            mb.month: (mb.id, mb.days, mb.load, mb.volume)
+            for mb in MemberMonthBooking.objects.filter(project_member=member)
+        }
+
+    def month_totals(self, member):
+        # эталон: суммы месячной загрузки записей участника
+        totals = {}
+        for mb in MonthBooking.objects.filter(booking__project_member=member):
+            days, load, volume = totals.get(mb.month, (0, 0, 0))
+            totals[mb.month] = (days + mb.days, load + mb.load, volume + mb.volume)
+        return totals
+
+    def assertTotals(self, member):
+        rows = self.member_rows(member)
+        totals = self.month_totals(member)
+        self.assertEqual(sorted(rows), sorted(totals))
+        for month, (days, load, volume) in totals.items():
+            self.assertEqual(rows[month][1], days)
+            self.assertAlmostEqual(rows[month][2], load)
+            self.assertAlmostEqual(rows[month][3], volume)
+
+    def test_sync(self):
+        sync_member_month_booking([self.member.id])
+        self.assertTotals(self.member)
+        # данные участников, не переданных для пересчета, не изменяются
+        self.assertFalse(MemberMonthBooking.objects.filter(project_member=self.other).exists())
+
+        # изменение загрузки: март удаляется, февраль обновляется, январь не изменяется
+        before = self.member_rows(self.member)
+        booking = self.bookings[0]
+        booking.finish_date = date(2030, 2, 14)
+        sync_month_booking([booking])
+        self.bookings[1].delete()
+        sync_member_month_booking(ProjectMember.objects.all())
+
+        after = self.member_rows(self.member)
+        self.assertTotals(self.member)
+        self.assertTotals(self.other)
+        self.assertEqual(sorted(after), [date(2030, 1, 1), date(2030, 2, 1)])
+        self.assertEqual(after[date(2030, 1, 1)], before[date(2030, 1, 1)])
+        self.assertEqual(after[date(2030, 2, 1)][0], before[date(2030, 2, 1)][0])
+
+    def test_unchanged(self):
+        sync_member_month_booking([self.member.id, self.other.id])
+        # без изменений выполняются только запросы итогов и существующих записей
+        with self.assertNumQueries(2):
+            sync_member_month_booking([self.member.id, self.other.id])
+
+
+class BookingReportTest(TestCase):
+    months = [date(2030, 1, 1), date(2030, 2, 1), date(2030, 3, 1)]
+
+    def setUp(self):
+        member = create_member()
+        project = Project.objects.create(
+            business=member.project.business, short_name='P2', full_name='Проект 2',
+            start_date=date(2030, 1, 1), finish_date=date(2030, 12, 31)
+        )
+        self.employee = member.employee
+        other = Employee.objects.create(last_name='Петров', first_name='Петр', hire_date=date(2020, 1, 1))
+        Salary.objects.create(employee=self.employee, start_date=date(2029, 1, 1), amount=1000)
+
+        members = [
+            member,
+            ProjectMember.objects.create(project=project, employee=self.employee, role=member.role),
+            ProjectMember.objects.create(project=member.project, employee=other, role=member.role),
+        ]
+        # апрель за пределами периода отчета
+        for pm, month, load in ((0, 1, 50), (0, 2, 100), (1, 1, 30), (2, 2, 20), (2, 4, 40)):
+            MemberMonthBooking.objects.create(
+                project_member=members[pm], month=date(2030, month, 1), days=10, load=load, volume=load / 10)
+
+    def test_month_summary(self):
+        self.assertEqual(MonthBookingSummary.objects.all().get_booking(self.months), [
+            {'name': 'Иванов Иван', 'load': [80, 100, 0]},
+            {'name': 'Петров Петр', 'load': [0, 20, 0]},
+        ])
+        self.assertEqual(MonthBookingSummary.objects.none().get_booking(self.months), [])
+
+    def test_project_booking(self):
+        qs = ProjectBooking.objects.filter(month=date(2030, 1, 1))
+        # оплата: загрузка x оклад x коэффициент участия в бизнесе
+        self.assertEqual(qs.get_booking(['P', 'P2', 'P3'], salary_month=date(2030, 1, 1)), [
+            {'name': 'Иванов Иван', 'booking': [(50, 250), (30, 150), (0, 0)], 'total': (80, 400)},
+        ])
+        self.assertEqual(ProjectBooking.objects.filter(month=date(2030, 2, 1)).get_booking(['P']), [
+            {'name': 'Иванов Иван', 'booking': [(100, 0)], 'total': (100, 0)},
+            {'name': 'Петров Петр', 'booking': [(20, 0)], 'total': (20, 0)},
+        ])
+
+    def test_employee_booking(self):
+        self.assertEqual(MonthBookingEmployee.objects.all().get_booking(self.months, self.employee.id), (
+            [{'project': 'P', 'load': [50, 100, 0]}, {'project': 'P2', 'load': [30, 0, 0]}],
+            [80, 100, 0]
+        ))
+        self.assertEqual(MonthBookingEmployee.objects.all().get_booking(self.months, 0), ([], None))
+
+
+class MonthBookingQueueTest(TransactionTestCase):
+    def setUp(self):
+        self.member = create_member()
+
+    def book(self, start_date, finish_date, load=100, **kwargs):
+        return Booking.objects.create(
+            project_member=self.member, start_date=start_date, finish_date=finish_date, load=load, **kwargs)
+
+    def test_flush_on_commit(self):
+        with mock.patch('pplan.models.transaction.on_commit', wraps=transaction.on_commit) as on_commit:
+            with transaction.atomic():
+                booking = self.book(date(2030, 1, 1), date(2030, 2, 28))
+                booking.load = 50
+                booking.save()
+                self.book(date(2030, 3, 1), date(2030, 3, 31)).delete()
+                self.assertFalse(MonthBooking.objects.exists())
+        # один пересчет на транзакцию
+        self.assertEqual(on_commit.call_count, 1)
+
+        self.assertEqual(MonthBooking.objects.filter(booking=booking).count(), 2)
+        self.assertEqual(MemberMonthBooking.objects.filter(project_member=self.member).count(), 2)
+        self.member.refresh_from_db()
+        self.assertEqual(self.member.plan_finish_date, date(2030, 2, 28))
+        self.assertAlmostEqual(self.member.plan_load, 50)
+
+    def test_autocommit(self):
+        booking = self.book(date(2030, 1, 1), date(2030, 1, 31))
+        self.assertEqual(MonthBooking.objects.filter(booking=booking).count(), 1)
+        booking.finish_date = date(2030, 2, 28)
+        booking.save()
+        self.assertEqual(MonthBooking.objects.filter(booking=booking).count(), 2)
+
+    def test_rollback(self):
+        with self.assertRaises(ValueError):
+            with transaction.atomic():
+                self.book(date(2030, 1, 1), date(2030, 1, 31), id=999)
+                raise ValueError
+
+        # следующая транзакция потока пересчитывается независимо от отмененной
+        with transaction.atomic():
+            booking = self.book(date(2030, 3, 1), date(2030, 3, 31))
+        self.assertEqual(list(MonthBooking.objects.values_list('booking', 'month')), [(booking.id, date(2030, 3, 1))])
+        self.member.refresh_from_db()
+        self.assertEqual(self.member.plan_start_date, date(2030, 3, 1))
+
+    def test_savepoint_rollback(self):
+        with transaction.atomic():
+            # пересчет, зарегистрированный в отмененной точке сохранения, регистрируется повторно
+            with self.assertRaises(ValueError):
+                with transaction.atomic():
+                    self.book(date(2030, 1, 1), date(2030, 1, 31), id=999)
+                    raise ValueError
+            booking = self.book(date(2030, 3, 1), date(2030, 4, 30))
+        self.assertEqual(MonthBooking.objects.filter(booking=booking).count(), 2)
+        self.assertEqual(MemberMonthBooking.objects.filter(project_member=self.member).count(), 2)
+
+        with transaction.atomic():
+            booking.finish_date = date(2030, 5, 31)
+            booking.save()
+            # изменения отмененной вложенной точки сохранения не теряют пересчет внешней транзакции
+            with self.assertRaises(ValueError):
+                with transaction.atomic():
+                    self.book(date(2030, 7, 1), date(2030, 7, 31), id=998)
+                    raise ValueError
+        self.assertEqual(MonthBooking.objects.filter(booking=booking).count(), 3)
+        self.member.refresh_from_db()
+        self.assertEqual(self.member.plan_finish_date, date(2030, 5, 31))
+
+    def test_failed_flush_is_atomic(self):
+        booking = self.book(date(2030, 1, 1), date(2030, 1, 31))
+
+        with mock.patch('pplan.models.sync_member_month_booking', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                booking.finish_date = date(2030, 2, 28)
+                booking.save()
+
+        # пересчет отменен целиком
+        self.assertEqual(MonthBooking.objects.filter(booking=booking).count(), 1)
+        self.member.refresh_from_db()
+        self.assertEqual(self.member.plan_finish_date, date(2030, 1, 31))
+
+        # следующее изменение пересчитывается заново
+        booking.save()
+        self.assertEqual(MonthBooking.objects.filter(booking=booking).count(), 2)
+        self.assertEqual(MemberMonthBooking.objects.filter(project_member=self.member).count(), 2)
@@ -1,12 +1,12 @@
 # pylint: disable=no-member
-from datetime import date, timedelta
+from datetime import date
 
 from django.contrib import admin, messages
-from django.db import transaction
+from django.db.models import Max, Min
 from django.utils import timezone
 
 from .models import HolidayName, SpecialDay, WorktimeStandards
-from .utils import standards_report, WEEKEND
+from .utils import generate_holidays, standards_matrix, standards_report
 
 # Register your models here.
 
@@ -74,41 +74,16 @@ class SpecialDayAdmin(admin.ModelAdmin):
     '''
     Редактирование календаря измененных дней
     '''
-    @transaction.atomic
-    def _add_holidays(self, request, queryset, year):
-        hd_qs = HolidayName.objects.all()
-        for hd in hd_qs:
-            # установка сокращенного дня перед началом праздника
-            short_date = date(year, hd.month, hd.day) - timedelta(1)
-            # если уже не установленный  день и не выходной
-            if not SpecialDay.objects.filter(date=short_date).exists() and \
-               not short_date.weekday() in WEEKEND:
-                SpecialDay.objects.update_or_create(
-                    date=short_date,
-                    defaults={'daytype':SpecialDay.SHORTENED}
-                )
-
-            # установка праздничных дней
-            count = hd.count
-            n = 0
-            while n < count:
-                holiday_date = date(year, hd.month, hd.day) + timedelta(n)
-                # смещение праздника на первый нерабочий день, кроме января
-                if holiday_date.weekday() in WEEKEND and not holiday_date.month == 1:
-                    count += 1
-                    n += 1
-                    continue
-                # если уже не установленный  день
-                if not SpecialDay.objects.filter(date=holiday_date).exists():
-                    SpecialDay.objects.update_or_create(
-                        date=holiday_date,
-                        defaults={
-                            'daytype':SpecialDay.HOLIDAY,
-                            'dayname':hd
-                        }
-                    )
-                n += 1
-        self.message_user(request, f'Праздники добавлены в календарь {year} года, установите корректный перенос праздничных дат января')
+    # Число лет для заполнения календаря на несколько лет вперед
+    GENERATE_YEARS = 10
+
+    def _add_holidays(self, request, queryset, first_year, last_year=None):
+        result = generate_holidays(first_year, last_year or first_year)
+        inserted = sum(r[1] for r in result)
+        skipped = sum(r[2] for r in result)
+        years = f'{first_year}-{last_year} годов' if last_year else f'{first_year} года'
+        self.message_user(request, f'Праздники добавлены в календарь {years}: добавлено дней {inserted}, \
+            пропущено ранее установленных {skipped}, установите корректный перенос праздничных дат января')
    
     def add_holidays(self, request, queryset):
         year = _get_year_param(self, request)
@@ -134,10 +109,18 @@ class SpecialDayAdmin(admin.ModelAdmin):
         self._add_holidays(request, queryset, year - 1)
     add_holidays_prev.short_description = 'Добавить праздники в календарь предыдущего года'
 
+    def add_holidays_years(self, request, queryset):
+        year = _get_year_param(self, request)
+        if not year:
+            return # некорректный параметр года
+        # заполнение календаря
+        self._add_holidays(request, queryset, year, year + self.GENERATE_YEARS - 1)
+    add_holidays_years.short_description = f'Добавить праздники в календарь на {GENERATE_YEARS} лет, начиная с текущего года'
+
     list_display = ('date', 'daytype', 'dayname', 'comment')
     list_filter = (YearFilter, 'daytype', 'dayname') 
     date_hierarchy = 'date'
-    actions = (add_holidays_prev, add_holidays, add_holidays_next) 
+    actions = (add_holidays_prev, add_holidays, add_holidays_next, add_holidays_years) 
 
 
 @admin.register(WorktimeStandards)
@@ -147,6 +130,9 @@ class WorktimeStandardsAdmin(admin.ModelAdmin):
     '''
     change_list_template = 'admin/worktime_standards_change_list.html'
 
+    # Число лет в сравнительной таблице
+    COMPARE_YEARS = 10
+
     list_display_links = None
     list_filter = (YearFilter,)
     
@@ -169,8 +155,20 @@ class WorktimeStandardsAdmin(admin.ModelAdmin):
             self.message_user(request, f'Указан ошибочный параметр, выберите параметр из фильтра', messages.ERROR)
             return response
 
+        # диапазон лет заполненного календаря для сравнительной таблицы, включая выбранный год
+        span = SpecialDay.objects.aggregate(first=Min('date'), last=Max('date'))
+        last_year = max(year, span['last'].year if span['last'] else year)
+        first_year = min(year, max(span['first'].year if span['first'] else year, last_year - self.COMPARE_YEARS + 1))
+        years = standards_matrix(first_year, last_year)[2]
+
         response.context_data['year'] = year
         response.context_data['header'] = ['Календарных', 'Рабочих', 'Выходных', 'Загрузка 100%', 'Загрузка 70%','Загрузка 50%']
         response.context_data['summary'] = standards_report(year)
+        response.context_data['years'] = [
+            {
+                'name': first_year + i,
+                'stat': stat
+            } for i, stat in enumerate(years.tolist())
+        ]
 
         return response
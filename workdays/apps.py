@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class WorkdaysConfig(AppConfig):
     name = 'workdays'
     verbose_name = 'Производственный календарь'
+
+    def ready(self):
+        # подключение обработчиков сигналов моделей
+        from . import signals  # pylint: disable=unused-import
@@ -0,0 +1,107 @@
+from datetime import date, timedelta
+
+import numpy as np
+
+# TODO: настройка
+WORKHOURS = 8    # число рабочих часов в стандартном дне
+WEEKEND = (5,6)  # список выходных (понедельник = 0)
+
+
+class CalendarIndex:
+    '''
+    Индекс производственного календаря за диапазон лет
+
+    Хранит накопленные суммы рабочих дней, выходных и рабочих часов по дням диапазона,
+    итоги для любого интервала дат внутри диапазона вычисляются по двум значениям индекса
+    '''
+    def __init__(self, first_year, last_year, special_map):
+        self.first_year = first_year
+        self.last_year = last_year
+        self.start = date(first_year, 1, 1)
+        self.stop = date(last_year + 1, 1, 1)
+        size = (self.stop - self.start).days
+
+        # дни недели для каждого дня диапазона (понедельник = 0)
+        weekday = (np.arange(size) + self.start.weekday()) % 7
+        holiday = np.isin(weekday, WEEKEND).astype(np.int64)
+        workday = 1 - holiday
+        hours = workday * WORKHOURS
+
+        # специальные дни (день, часов) из производственного календаря
+        for day, (w, h, hr) in special_map.items():
+            i = (day - self.start).days
+            if 0 <= i < size:
+                workday[i], holiday[i], hours[i] = w, h, hr
+
+        # накопленные суммы с нулем в начале: элемент i - итог за дни диапазона до i-го
+        self.cumsum = np.zeros((3, size + 1), dtype=np.int64)
+        np.cumsum(np.stack((workday, holiday, hours)), axis=1, out=self.cumsum[:, 1:])
+
+    def covers(self, fromdate, todate):
+        return self.start <= fromdate and todate < self.stop
+
+    def position(self, day):
+        return (day - self.start).days
+
+    def totals(self, fromdate, todate):
+        '''
+        Число рабочих дней, выходных и рабочих часов в заданных границах (включительно)
+        '''
+        if todate < fromdate:
+            return 0, 0, 0
+        totals = self.cumsum[:, self.position(todate) + 1] - self.cumsum[:, self.position(fromdate)]
+        return tuple(int(x) for x in totals)
+
+    def finish_date(self, fromdate, days):
+        '''
+        Последний день интервала, начинающегося с fromdate и содержащего days рабочих дней
+
+        Возвращает None, если интервал выходит за границы индекса
+        '''
+        workday = self.cumsum[0]
+        i = np.searchsorted(workday, workday[self.position(fromdate)] + days, side='left')
+        if i >= len(workday):
+            return None
+        return self.start + timedelta(days=int(i) - 1)
+
+    def start_date(self, todate, days):
+        '''
+        Первый день интервала, заканчивающегося на todate и содержащего days рабочих дней
+
+        Возвращает None, если интервал выходит за границы индекса
+        '''
+        workday = self.cumsum[0]
+        target = workday[self.position(todate) + 1] - days
+        if target < 0:
+            return None
+        i = np.searchsorted(workday, target, side='right') - 1
+        return self.start + timedelta(days=int(i))
+
+    def month_totals(self, first_year, last_year):
+        '''
+        Помесячные итоги за диапазон лет по границам месяцев
+
+        Возвращает массивы длины 12 * число лет: календарных дней, рабочих дней, выходных, рабочих часов
+        '''
+        months = np.arange(
+            np.datetime64(date(first_year, 1, 1), 'M'),
+            np.datetime64(date(last_year + 1, 1, 1), 'M') + 1
+        )
+        # позиции первых дней месяцев в индексе
+        bounds = (months.astype('datetime64[D]') - np.datetime64(self.start, 'D')).astype(np.int64)
+        workday, holiday, hours = np.diff(self.cumsum[:, bounds], axis=1)
+        return np.diff(bounds), workday, holiday, hours
+
+    def totals_array(self, fromdates, todates):
+        '''
+        Числа рабочих дней, выходных и рабочих часов для массивов границ интервалов
+
+        Границы передаются массивами numpy.datetime64[D] одинаковой длины,
+        результат - массив 3 x N, для пустых интервалов (todate < fromdate) нули
+        '''
+        start = np.datetime64(self.start, 'D')
+        lo = (fromdates - start).astype(np.int64)
+        hi = (todates - start).astype(np.int64) + 1
+        empty = hi <= lo
+        hi[empty] = lo[empty] = 0
+        return self.cumsum[:, hi] - self.cumsum[:, lo]
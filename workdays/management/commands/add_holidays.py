@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from workdays.utils import generate_holidays
+
+
+class Command(BaseCommand):
+    '''
+    Заполнение производственного календаря праздниками за диапазон лет
+    '''
+    help = 'Добавляет в календарь праздничные и сокращенные дни по справочнику праздников за диапазон лет'
+
+    def add_arguments(self, parser):
+        parser.add_argument('first_year', type=int, help='Первый год диапазона')
+        parser.add_argument('last_year', type=int, nargs='?', help='Последний год диапазона (по умолчанию равен первому)')
+
+    def handle(self, *args, **options):
+        first_year = options['first_year']
+        last_year = options['last_year'] or first_year
+        if last_year < first_year:
+            raise CommandError(f'Последний год {last_year} не может быть ранее первого {first_year}')
+
+        for year, inserted, skipped in generate_holidays(first_year, last_year):
+            self.stdout.write(f'{year}: добавлено дней {inserted}, пропущено ранее установленных {skipped}')
+        self.stdout.write(self.style.SUCCESS('Праздники добавлены, установите корректный перенос праздничных дат января'))
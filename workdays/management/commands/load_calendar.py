@@ -0,0 +1,244 @@
+import csv
+import json
+import os
+
+import pandas as pd
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connection, transaction
+
+from workdays.models import HolidayName, SpecialDay
+from workdays.utils import production_calendar
+
+HOLIDAYNAME = 'workdays.holidayname'
+SPECIALDAY = 'workdays.specialday'
+
+
+def iter_json_array(stream, chunk_size=64 * 1024, max_item_size=1024 * 1024):
+    '''
+    Инкрементальный разбор JSON-массива из потока: генератор элементов массива,
+    в памяти хранится только необработанный остаток прочитанного блока
+
+    Ошибки разбора сообщаются с позицией в файле, элемент больше max_item_size символов считается ошибкой
+    '''
+    decoder = json.JSONDecoder()
+    buffer = ''
+    pos = 0
+    # позиция начала буфера в файле
+    offset = 0
+    eof = False
+    started = False
+    # после элемента массива ожидается ровно одна запятая или конец массива
+    separator = False
+    comma = False
+
+    def error(message, at):
+        return CommandError(f'Ошибка разбора JSON в позиции {offset + at}: {message}')
+
+    while True:
+        # пропуск пробелов, дочитывание потока при исчерпании буфера
+        while pos < len(buffer) and buffer[pos].isspace():
+            pos += 1
+        if pos == len(buffer):
+            if eof:
+                raise CommandError('Неожиданный конец файла: JSON-массив не закрыт')
+            offset += len(buffer)
+            buffer, pos = stream.read(chunk_size), 0
+            eof = not buffer
+            continue
+
+        if not started:
+            if buffer[pos] != '[':
+                raise CommandError('Файл календаря должен содержать JSON-массив объектов')
+            started = True
+            pos += 1
+            continue
+
+        if buffer[pos] == ']':
+            if comma:
+                raise error('запятая перед концом массива', pos)
+            return
+
+        if buffer[pos] == ',':
+            if not separator:
+                raise error('лишняя запятая в массиве', pos)
+            separator, comma = False, True
+            pos += 1
+            continue
+
+        if separator:
+            raise error('элементы массива должны разделяться запятой', pos)
+
+        try:
+            item, end = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError as e:
+            # дочитывание только если элемент может продолжаться в следующем блоке:
+            # ошибка в конце буфера (в том числе внутри последнего литерала) или незакрытая строка
+            incomplete = (
+                len(buffer) - e.pos < 16 or
+                e.msg.startswith('Unterminated string')
+            )
+            if eof or not incomplete:
+                raise error(e.msg, e.pos)
+            if len(buffer) - pos > max_item_size:
+                raise error(f'элемент массива больше {max_item_size} символов', pos)
+            chunk = stream.read(chunk_size)
+            eof = not chunk
+            offset += pos
+            buffer, pos = buffer[pos:] + chunk, 0
+            continue
+
+        if end == len(buffer) and not eof:
+            # значение на границе блока (например, число) может продолжаться в следующем блоке
+            chunk = stream.read(chunk_size)
+            eof = not chunk
+            offset += pos
+            buffer, pos = buffer[pos:] + chunk, 0
+            continue
+
+        yield item
+        pos = end
+        separator, comma = True, False
+
+
+def iter_json_calendar(stream):
+    '''
+    Записи календаря из JSON в формате выгрузки dumpdata: (модель, pk, поля)
+    '''
+    for item in iter_json_array(stream):
+        yield item.get('model'), item.get('pk'), item.get('fields', {})
+
+
+def iter_csv_calendar(stream):
+    '''
+    Записи календаря из CSV с заголовком date,daytype,dayname,comment
+    (dayname - id наименования праздника, может быть пустым)
+    '''
+    reader = csv.DictReader(stream)
+    for row in reader:
+        try:
+            dayname = int(row['dayname']) if row.get('dayname') else None
+        except ValueError:
+            raise CommandError(f'Некорректный id наименования праздника в строке {reader.line_num}: {row["dayname"]}')
+        yield SPECIALDAY, None, {
+            'date': row.get('date'),
+            'daytype': row.get('daytype') or SpecialDay.HOLIDAY,
+            'dayname': dayname,
+            'comment': row.get('comment') or None,
+        }
+
+
+class Command(BaseCommand):
+    '''
+    Потоковая загрузка производственного календаря из файлов JSON или CSV
+    '''
+    help = 'Загружает наименования праздников и специальные дни календаря из файла JSON (формат dumpdata) или CSV'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Путь к файлу календаря')
+        parser.add_argument('--format', choices=('json', 'csv'), help='Формат файла (по умолчанию - по расширению)')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Число записей в пакете записи')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format'] or os.path.splitext(path)[1].lstrip('.').lower()
+        if fmt not in ('json', 'csv'):
+            raise CommandError(f'Неизвестный формат файла {path}, укажите --format')
+        self.batch_size = options['batch_size']
+        self.counts = {HOLIDAYNAME: [0, 0], SPECIALDAY: [0, 0]}
+        self.skipped = 0
+        self.dates = set()
+
+        with open(path, encoding='utf-8', newline='') as stream, transaction.atomic():
+            records = iter_json_calendar(stream) if fmt == 'json' else iter_csv_calendar(stream)
+            self._load(records)
+            self._reset_sequences()
+
+        # массовая запись не вызывает сигналов сохранения - сброс кэша календаря один раз
+        production_calendar.reset()
+
+        for model, (inserted, updated) in self.counts.items():
+            self.stdout.write(f'{model}: добавлено {inserted}, обновлено {updated}')
+        if self.skipped:
+            self.stdout.write(self.style.WARNING(f'Пропущено записей других моделей: {self.skipped}'))
+        self.stdout.write(self.style.SUCCESS('Календарь загружен'))
+
+    def _reset_sequences(self):
+        # записи с явными id не сдвигают последовательности (как после loaddata) -
+        # иначе следующая созданная запись получит занятый id
+        statements = connection.ops.sequence_reset_sql(no_style(), [HolidayName, SpecialDay])
+        if statements:
+            with connection.cursor() as cursor:
+                for sql in statements:
+                    cursor.execute(sql)
+
+    def _load(self, records):
+        holidays, days = [], []
+        for model, pk, fields in records:
+            if model == HOLIDAYNAME:
+                holidays.append(HolidayName(pk=pk, **fields))
+            elif model == SPECIALDAY:
+                days.append(fields)
+            else:
+                self.skipped += 1
+                continue
+
+            if len(holidays) + len(days) >= self.batch_size:
+                self._flush(holidays, days)
+                holidays, days = [], []
+        self._flush(holidays, days)
+
+    def _flush(self, holidays, days):
+        # наименования праздников записываются первыми, на них ссылаются специальные дни
+        if holidays:
+            self._upsert_holidays(holidays)
+        if days:
+            self._upsert_days(days)
+
+    def _upsert_holidays(self, holidays):
+        existing = set(HolidayName.objects.filter(
+            pk__in=[h.pk for h in holidays if h.pk is not None]).values_list('pk', flat=True))
+        updated = [h for h in holidays if h.pk in existing]
+        inserted = [h for h in holidays if h.pk not in existing]
+
+        HolidayName.objects.bulk_update(updated, ('dayname', 'month', 'day', 'count'))
+        HolidayName.objects.bulk_create(inserted)
+        self.counts[HOLIDAYNAME][0] += len(inserted)
+        self.counts[HOLIDAYNAME][1] += len(updated)
+
+    def _upsert_days(self, days):
+        df = pd.DataFrame(days, columns=('date', 'daytype', 'dayname', 'comment'))
+
+        # проверка всего пакета: корректность дат, типов дней и уникальность дат
+        dates = pd.to_datetime(df['date'], format='%Y-%m-%d', errors='coerce')
+        invalid = df.loc[dates.isnull(), 'date']
+        if not invalid.empty:
+            raise CommandError(f'Некорректные даты: {", ".join(map(str, invalid))}')
+        invalid = df.loc[~df['daytype'].isin([c[0] for c in SpecialDay.DAYTYPE_CHOICES]), 'daytype']
+        if not invalid.empty:
+            raise CommandError(f'Некорректные типы дней: {", ".join(map(str, invalid.unique()))}')
+        df['date'] = dates.dt.date
+        # повторы проверяются в пакете и среди дат предыдущих пакетов файла
+        invalid = df.loc[df['date'].duplicated() | df['date'].isin(self.dates), 'date']
+        if not invalid.empty:
+            raise CommandError(f'Повторяющиеся даты: {", ".join(map(str, invalid))}')
+        self.dates.update(df['date'])
+
+        # специальные дни уникальны по дате, существующие обновляются
+        existing = dict(SpecialDay.objects.filter(date__in=df['date'].tolist()).values_list('date', 'pk'))
+        objs = [
+            SpecialDay(
+                pk=existing.get(row.date),
+                date=row.date,
+                daytype=row.daytype,
+                dayname_id=None if pd.isnull(row.dayname) else int(row.dayname),
+                comment=None if pd.isnull(row.comment) else row.comment
+            ) for row in df.itertuples(index=False)
+        ]
+        updated = [obj for obj in objs if obj.pk is not None]
+        inserted = [obj for obj in objs if obj.pk is None]
+
+        SpecialDay.objects.bulk_update(updated, ('daytype', 'dayname', 'comment'))
+        SpecialDay.objects.bulk_create(inserted)
+        self.counts[SPECIALDAY][0] += len(inserted)
+        self.counts[SPECIALDAY][1] += len(updated)
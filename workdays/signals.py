@@ -0,0 +1,14 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import HolidayName, SpecialDay
+from .utils import production_calendar
+
+
+@receiver((post_save, post_delete), sender=SpecialDay)
+@receiver((post_save, post_delete), sender=HolidayName)
+def reset_calendar(sender, **kwargs):
+    '''
+    Сброс кэша производственного календаря при изменении специальных дней и праздников
+    '''
+    production_calendar.reset()
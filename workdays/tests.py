@@ -1,3 +1,389 @@
-from django.test import TestCase
+import io
+import os
+import tempfile
+from datetime import date, timedelta
 
-# Create your tests here.
+import numpy as np
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import transaction
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+
+from .calendar import WEEKEND, WORKHOURS, CalendarIndex
+from .management.commands.load_calendar import iter_json_array
+from .models import HolidayName, SpecialDay
+from .utils import (ProductionCalendar, add_workdays, finish_date, finish_date_for_volume, generate_holidays,
+                    holidays, holidays_array, production_calendar, standards_matrix, workdayholidayhours,
+                    workdays, workdays_array, workhours, workhours_array)
+
+
+def walk_totals(fromdate, todate, special_map):
+    '''
+    Эталонный расчет: обход интервала по дням
+    '''
+    totals = [0, 0, 0]
+    day = fromdate
+    while day <= todate:
+        if day in special_map:
+            values = special_map[day]
+        elif day.weekday() in WEEKEND:
+            values = (0, 1, 0)
+        else:
+            values = (1, 0, WORKHOURS)
+        totals = [t + v for t, v in zip(totals, values)]
+        day += timedelta(days=1)
+    return tuple(totals)
+
+
+def walk_finish_date(fromdate, days, special_map):
+    day = fromdate
+    while True:
+        if walk_totals(day, day, special_map)[0]:
+            days -= 1
+            if not days:
+                return day
+        day += timedelta(days=1)
+
+
+class CalendarIndexTest(SimpleTestCase):
+    special_map = {
+        date(2019, 1, 1): (0, 1, 0),
+        date(2019, 1, 2): (0, 1, 0),
+        date(2019, 2, 22): (1, 0, WORKHOURS - 1),
+        date(2019, 3, 8): (0, 1, 0),
+        date(2019, 5, 4): (1, 0, WORKHOURS),
+        date(2019, 12, 31): (0, 1, 0),
+        date(2020, 1, 1): (0, 1, 0),
+    }
+
+    def setUp(self):
+        self.index = CalendarIndex(2019, 2020, self.special_map)
+
+    def test_totals(self):
+        start = date(2019, 1, 1)
+        for offset, length in ((0, 0), (0, 1), (0, 364), (30, 10), (52, 20), (120, 6), (360, 10), (0, 730)):
+            fromdate = start + timedelta(days=offset)
+            todate = fromdate + timedelta(days=length)
+            with self.subTest(fromdate=fromdate, todate=todate):
+                self.assertEqual(
+                    self.index.totals(fromdate, todate),
+                    walk_totals(fromdate, todate, self.special_map)
+                )
+
+    def test_empty_interval(self):
+        self.assertEqual(self.index.totals(date(2019, 5, 2), date(2019, 5, 1)), (0, 0, 0))
+
+    def test_finish_date(self):
+        for fromdate, days in ((date(2019, 1, 1), 1), (date(2019, 2, 20), 5), (date(2019, 5, 3), 2), (date(2019, 12, 30), 3)):
+            with self.subTest(fromdate=fromdate, days=days):
+                self.assertEqual(
+                    self.index.finish_date(fromdate, days),
+                    walk_finish_date(fromdate, days, self.special_map)
+                )
+
+    def test_finish_date_out_of_range(self):
+        self.assertIsNone(self.index.finish_date(date(2020, 12, 1), 100))
+
+    def test_start_date(self):
+        finish = self.index.finish_date(date(2019, 2, 20), 5)
+        self.assertEqual(self.index.start_date(finish, 5), date(2019, 2, 20))
+
+
+class ProductionCalendarTest(TestCase):
+    def setUp(self):
+        SpecialDay.objects.filter(date__year__in=(2031, 2032)).delete()
+        SpecialDay.objects.create(date=date(2031, 3, 7), daytype=SpecialDay.SHORTENED)
+        SpecialDay.objects.create(date=date(2031, 3, 10), daytype=SpecialDay.HOLIDAY)
+        production_calendar.reset()
+
+    def test_totals_match_walk(self):
+        special_map = {
+            day.date: day.workdayholidayhours(WORKHOURS)
+            for day in SpecialDay.objects.filter(date__year=2031)
+        }
+        fromdate, todate = date(2031, 3, 1), date(2031, 3, 31)
+        self.assertEqual(workdayholidayhours(fromdate, todate)[:3], walk_totals(fromdate, todate, special_map))
+        self.assertEqual(finish_date(date(2031, 3, 7), 2), date(2031, 3, 11))
+
+    def test_reset_on_change(self):
+        self.assertEqual(workdayholidayhours(date(2031, 3, 11), date(2031, 3, 11))[0], 1)
+        SpecialDay.objects.create(date=date(2031, 3, 11), daytype=SpecialDay.HOLIDAY)
+        self.assertEqual(workdayholidayhours(date(2031, 3, 11), date(2031, 3, 11))[0], 0)
+
+
+class CalendarTestCase(TestCase):
+    '''
+    Календарь 2031 года: сокращенный день, праздник и рабочая суббота
+    '''
+    def setUp(self):
+        SpecialDay.objects.filter(date__year__in=(2031, 2032)).delete()
+        SpecialDay.objects.create(date=date(2031, 3, 7), daytype=SpecialDay.SHORTENED)
+        SpecialDay.objects.create(date=date(2031, 3, 10), daytype=SpecialDay.HOLIDAY)
+        SpecialDay.objects.create(date=date(2031, 3, 15), daytype=SpecialDay.WORK)
+        production_calendar.reset()
+        self.special_map = {
+            day.date: day.workdayholidayhours(WORKHOURS)
+            for day in SpecialDay.objects.filter(date__year__in=(2031, 2032))
+        }
+
+
+class WorkdaysArrayTest(CalendarTestCase):
+
+    def test_matches_scalar(self):
+        # интервалы внутри месяца, через границу года и пустые интервалы
+        intervals = [
+            (date(2031, 3, 1), date(2031, 3, 31)), (date(2031, 3, 10), date(2031, 3, 10)),
+            (date(2031, 12, 20), date(2032, 1, 10)), (date(2031, 3, 15), date(2031, 3, 14)),
+            (date(2030, 6, 1), date(2032, 6, 1)),
+        ]
+        fromdates, todates = zip(*intervals)
+        for func, scalar in ((workdays_array, workdays), (holidays_array, holidays), (workhours_array, workhours)):
+            with self.subTest(func=func.__name__):
+                self.assertEqual(
+                    func(fromdates, todates).tolist(),
+                    [scalar(fromdate, todate) for fromdate, todate in intervals]
+                )
+
+    def test_empty(self):
+        self.assertEqual(workdays_array([], []).tolist(), [])
+        self.assertEqual(workdays_array([date(2031, 3, 2)], [date(2031, 3, 1)]).tolist(), [0])
+
+
+class AddWorkdaysTest(CalendarTestCase):
+    def walk(self, day, count):
+        # эталон: пошаговый обход дней с подсчетом рабочих
+        step = timedelta(days=1 if count > 0 else -1)
+        while count:
+            day += step
+            if walk_totals(day, day, self.special_map)[0]:
+                count -= 1 if count > 0 else -1
+        return day
+
+    def test_add_workdays(self):
+        for day in (date(2031, 3, 6), date(2031, 3, 7), date(2031, 3, 9), date(2031, 3, 14), date(2031, 12, 30)):
+            for count in (-5, -1, 1, 2, 10):
+                with self.subTest(day=day, count=count):
+                    self.assertEqual(add_workdays(day, count), self.walk(day, count))
+        self.assertEqual(add_workdays(date(2031, 3, 9), 0), date(2031, 3, 9))
+        # через праздник и на рабочую субботу
+        self.assertEqual(add_workdays(date(2031, 3, 7), 1), date(2031, 3, 11))
+        self.assertEqual(add_workdays(date(2031, 3, 14), 1), date(2031, 3, 15))
+        self.assertEqual(add_workdays(date(2031, 3, 11), -1), date(2031, 3, 7))
+
+    def test_finish_date_for_volume(self):
+        # 1,5 чел.дн. при загрузке 50% - 3 рабочих дня, начиная с 6 марта
+        self.assertEqual(finish_date_for_volume(date(2031, 3, 6), 1.5, 50), date(2031, 3, 11))
+        # погрешность вычислений не добавляет лишний день: 1,1 * 100 / 55 = 2,0000000000000004
+        self.assertEqual(finish_date_for_volume(date(2031, 3, 6), 1.1, 55), date(2031, 3, 7))
+        # неполный день округляется вверх
+        self.assertEqual(finish_date_for_volume(date(2031, 3, 6), 1.1, 100), date(2031, 3, 7))
+        for volume, load in ((1, 0), (None, 50), (0, 50)):
+            with self.subTest(volume=volume, load=load):
+                self.assertIsNone(finish_date_for_volume(date(2031, 3, 6), volume, load))
+
+
+class StandardsMatrixTest(CalendarTestCase):
+    def month_row(self, year, month):
+        fromdate = date(year, month, 1)
+        todate = date(year + month // 12, month % 12 + 1, 1) - timedelta(days=1)
+        work, holiday, hours = walk_totals(fromdate, todate, self.special_map)
+        return [(todate - fromdate).days + 1, work, holiday, hours, hours * 0.7, hours * 0.5]
+
+    def test_matches_month_walk(self):
+        months, quarters, years = standards_matrix(2031, 2032)
+        expected = [self.month_row(year, month) for year in (2031, 2032) for month in range(1, 13)]
+
+        self.assertEqual(months.shape, (24, 6))
+        self.assertTrue(np.allclose(months, expected))
+        self.assertTrue(np.allclose(quarters, [np.sum(expected[i:i + 3], axis=0) for i in range(0, 24, 3)]))
+        self.assertTrue(np.allclose(years, [np.sum(expected[:12], axis=0), np.sum(expected[12:], axis=0)]))
+        self.assertEqual(years[:, 0].tolist(), [365, 366])
+
+    def test_year_slice(self):
+        # строки года в многолетней матрице совпадают с матрицей одного года
+        months, quarters, years = standards_matrix(2031, 2032)
+        single = standards_matrix(2032, 2032)
+        self.assertTrue(np.allclose(months[12:], single[0]))
+        self.assertTrue(np.allclose(quarters[4:], single[1]))
+        self.assertTrue(np.allclose(years[1:], single[2]))
+
+
+class CalendarVersionTest(TransactionTestCase):
+    def setUp(self):
+        # кэш другого рабочего процесса, проверяющий метку версии при каждом обращении
+        self.other = ProductionCalendar()
+        self.other.VERSION_CHECK_INTERVAL = 0
+
+    def holiday(self):
+        return self.other.totals(date(2031, 3, 11), date(2031, 3, 11))[1]
+
+    def test_publish_on_commit(self):
+        self.assertEqual(self.holiday(), 0)
+        version = cache.get(ProductionCalendar.VERSION_KEY)
+
+        with transaction.atomic():
+            SpecialDay.objects.create(date=date(2031, 3, 11), daytype=SpecialDay.HOLIDAY)
+            # до фиксации транзакции метка версии не изменяется
+            self.assertEqual(cache.get(ProductionCalendar.VERSION_KEY), version)
+            self.assertEqual(self.holiday(), 0)
+
+        self.assertNotEqual(cache.get(ProductionCalendar.VERSION_KEY), version)
+        self.assertEqual(self.holiday(), 1)
+
+    def test_rollback(self):
+        version = cache.get(ProductionCalendar.VERSION_KEY)
+        with self.assertRaises(ValueError):
+            with transaction.atomic():
+                HolidayName.objects.create(dayname='Праздник', month=3, day=11, count=1)
+                raise ValueError
+        self.assertEqual(cache.get(ProductionCalendar.VERSION_KEY), version)
+
+
+class GenerateHolidaysTest(TestCase):
+    def setUp(self):
+        for dayname, month, day, count in (('Новый год', 1, 1, 8), ('Праздник', 3, 8, 1), ('Праздник весны', 5, 1, 2)):
+            HolidayName.objects.create(dayname=dayname, month=month, day=day, count=count)
+        # ранее установленный день не изменяется
+        SpecialDay.objects.create(date=date(2041, 5, 2), daytype=SpecialDay.WORK)
+
+    def walk_holidays(self, years):
+        '''
+        Эталон: поочередная установка дней с проверкой каждого дня по календарю
+        '''
+        days = dict(SpecialDay.objects.values_list('date', 'daytype'))
+        for year in years:
+            for hd in HolidayName.objects.all():
+                short_date = date(year, hd.month, hd.day) - timedelta(1)
+                if short_date not in days and short_date.weekday() not in WEEKEND:
+                    days[short_date] = SpecialDay.SHORTENED
+                count, n = hd.count, 0
+                while n < count:
+                    holiday_date = date(year, hd.month, hd.day) + timedelta(n)
+                    n += 1
+                    if holiday_date.weekday() in WEEKEND and holiday_date.month != 1:
+                        count += 1
+                    elif holiday_date not in days:
+                        days[holiday_date] = SpecialDay.HOLIDAY
+        return days
+
+    def test_matches_walk(self):
+        expected = self.walk_holidays((2041, 2042))
+        workdays_before = workdays(date(2041, 3, 1), date(2041, 5, 31))
+
+        result = generate_holidays(2041, 2042)
+
+        self.assertEqual(dict(SpecialDay.objects.values_list('date', 'daytype')), expected)
+        self.assertEqual(SpecialDay.objects.get(date=date(2041, 5, 2)).daytype, SpecialDay.WORK)
+        self.assertEqual(SpecialDay.objects.get(date=date(2042, 1, 8)).dayname.dayname, 'Новый год')
+        self.assertEqual([year for year, inserted, skipped in result], [2041, 2042])
+        self.assertEqual(sum(inserted for year, inserted, skipped in result), len(expected) - 1)
+        self.assertEqual(result[0][2], 1)
+        # кэш календаря сброшен после массовой вставки
+        self.assertLess(workdays(date(2041, 3, 1), date(2041, 5, 31)), workdays_before)
+
+    def test_repeat(self):
+        generate_holidays(2041, 2041)
+        count = SpecialDay.objects.count()
+        # все дни года, включая ранее установленный, пропускаются
+        self.assertEqual(generate_holidays(2041, 2041), [(2041, 0, count)])
+        self.assertEqual(SpecialDay.objects.count(), count)
+
+    def test_command(self):
+        stdout = io.StringIO()
+        call_command('add_holidays', '2041', '2042', stdout=stdout)
+        self.assertIn('2042: добавлено дней', stdout.getvalue())
+        with self.assertRaises(CommandError):
+            call_command('add_holidays', '2042', '2041', stdout=io.StringIO())
+
+
+class IterJsonArrayTest(SimpleTestCase):
+    def parse(self, text, chunk_size=3):
+        return list(iter_json_array(io.StringIO(text), chunk_size=chunk_size))
+
+    def test_parse(self):
+        self.assertEqual(self.parse('[]'), [])
+        self.assertEqual(self.parse(' [ 1 , 22 ,\n{"a": [1, 2]}, "x,y" ] '), [1, 22, {'a': [1, 2]}, 'x,y'])
+        self.assertEqual(self.parse('[12345, 678]', chunk_size=2), [12345, 678])
+
+    def test_malformed(self):
+        for text in ('', '{}', '[1 2]', '[1,,2]', '[,1]', '[1,]', '[1', '[1,', '[{"a": 1]'):
+            with self.subTest(text=text):
+                with self.assertRaises(CommandError):
+                    self.parse(text)
+
+    def test_values_across_blocks(self):
+        text = '[{"name": "длинная строка через несколько блоков", "flag": true, "value": 1.25}, null, false]'
+        self.assertEqual(self.parse(text, chunk_size=4), [
+            {'name': 'длинная строка через несколько блоков', 'flag': True, 'value': 1.25}, None, False
+        ])
+
+    def test_error_position_without_reading_rest(self):
+        stream = io.StringIO('[{"a": 1}, {"b": x}, ' + ', '.join(['{"c": 1}'] * 1000) + ']')
+        with self.assertRaisesRegex(CommandError, 'позиции 17'):
+            list(iter_json_array(stream, chunk_size=32))
+        # ошибка обнаружена без чтения остатка файла
+        self.assertLess(stream.tell(), 100)
+
+    def test_item_size_limit(self):
+        with self.assertRaisesRegex(CommandError, 'больше 10 символов'):
+            list(iter_json_array(io.StringIO('["' + 'x' * 100 + '"]'), chunk_size=4, max_item_size=10))
+
+
+class LoadCalendarTest(TestCase):
+    def load(self, content, suffix, *args):
+        fd, path = tempfile.mkstemp(suffix=suffix)
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(content)
+        try:
+            call_command('load_calendar', path, *args, stdout=io.StringIO())
+        finally:
+            os.remove(path)
+
+    def test_json(self):
+        self.load('''[
+            {"model": "workdays.holidayname", "pk": 901, "fields": {"dayname": "Праздник", "month": 3, "day": 9, "count": 1}},
+            {"model": "workdays.specialday", "fields": {"date": "2041-03-09", "daytype": "HL", "dayname": 901}},
+            {"model": "workdays.specialday", "fields": {"date": "2041-03-08", "daytype": "SH"}},
+            {"model": "auth.user", "fields": {}}
+        ]''', '.json', '--batch-size', '2')
+        self.assertEqual(HolidayName.objects.get(pk=901).dayname, 'Праздник')
+        self.assertEqual(
+            list(SpecialDay.objects.filter(date__year=2041).values_list('date', 'daytype', 'dayname')),
+            [(date(2041, 3, 8), 'SH', None), (date(2041, 3, 9), 'HL', 901)]
+        )
+
+        # повторная загрузка обновляет существующие дни
+        self.load('date,daytype,dayname,comment\n2041-03-08,WK,,перенос\n', '.csv')
+        day = SpecialDay.objects.get(date=date(2041, 3, 8))
+        self.assertEqual((day.daytype, day.comment), ('WK', 'перенос'))
+        self.assertEqual(SpecialDay.objects.filter(date__year=2041).count(), 2)
+
+    def test_invalid_rows(self):
+        for content in (
+            'date,daytype,dayname,comment\n2041-02-30,HL,,\n',
+            'date,daytype,dayname,comment\n2041-02-03,XX,,\n',
+            'date,daytype,dayname,comment\n2041-02-03,HL,,\n2041-02-03,SH,,\n',
+        ):
+            with self.subTest(content=content):
+                with self.assertRaises(CommandError):
+                    self.load(content, '.csv')
+        self.assertFalse(SpecialDay.objects.filter(date__year=2041).exists())
+
+    def test_invalid_dayname(self):
+        with self.assertRaisesRegex(CommandError, 'строке 3: праздник'):
+            self.load('date,daytype,dayname,comment\n2041-02-03,HL,,\n2041-02-04,HL,праздник,\n', '.csv')
+
+    def test_create_after_load(self):
+        self.load('''[
+            {"model": "workdays.holidayname", "pk": 950, "fields": {"dayname": "Праздник", "month": 3, "day": 9, "count": 1}}
+        ]''', '.json')
+        # последовательность id сдвинута за загруженные записи
+        holiday = HolidayName.objects.create(dayname='Новый праздник', month=4, day=1, count=1)
+        self.assertGreater(holiday.pk, 950)
+
+    def test_duplicate_dates_across_batches(self):
+        with self.assertRaises(CommandError):
+            self.load('date,daytype,dayname,comment\n2041-02-03,HL,,\n2041-02-04,HL,,\n2041-02-03,SH,,\n',
+                      '.csv', '--batch-size', '1')
+        self.assertFalse(SpecialDay.objects.filter(date__year=2041).exists())
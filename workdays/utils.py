@@ -1,15 +1,21 @@
 # pylint: disable=no-member
 import itertools as it
+import math
+import operator
+import time
+import uuid
 from datetime import date, timedelta
+from functools import reduce
 
-from django.utils import timezone
-from monthdelta import monthdelta 
+import numpy as np
 
-from .models import SpecialDay
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
 
-# TODO: настройка
-WORKHOURS = 8    # число рабочих часов в стандартном дне
-WEEKEND = (5,6)  # список выходных (понедельник = 0)
+from .calendar import WEEKEND, WORKHOURS, CalendarIndex
+from .models import HolidayName, SpecialDay
 
 MONTHS = [
         (1, 'Январь'),
@@ -45,43 +51,146 @@ def tomorrow():
     return today() + timedelta(days=1)
 
 def is_holiday(date):
-    holiday = SpecialDay.objects.filter(date=date).first()
-    if holiday:
-        return holiday.daytype == SpecialDay.HOLIDAY
-    else:
-        return date.weekday() in WEEKEND
+    return production_calendar.totals(date, date)[1] == 1
 
 def days(fromdate, todate):
     return (todate - fromdate).days + 1
 
+class ProductionCalendar:
+    '''
+    Кэш производственного календаря в памяти процесса
+
+    Специальные дни загружаются лениво по годам и хранятся словарем (день, часов) на каждый год,
+    индекс накопленных сумм строится по загруженным годам и расширяется при запросе дат вне диапазона.
+    Изменение календаря отмечается меткой версии в кэше Django, по которой 
+    остальные рабочие процессы сбрасывают свои данные
+    '''
+    VERSION_KEY = 'workdays.calendar.version'
+    # интервал проверки метки версии, сек.
+    VERSION_CHECK_INTERVAL = 1
+
+    def __init__(self):
+        self._years = {}
+        self._index = None
+        self._version = None
+        self._checked = 0
+
+    def _check_version(self):
+        now = time.monotonic()
+        if now - self._checked < self.VERSION_CHECK_INTERVAL:
+            return
+        self._checked = now
+        version = cache.get(self.VERSION_KEY)
+        if version != self._version:
+            self._clear()
+            self._version = version
+
+    def _clear(self):
+        self._years = {}
+        self._index = None
+
+    def _load_years(self, years):
+        missing = [year for year in years if year not in self._years]
+        if not missing:
+            return
+        special_maps = { year:{} for year in missing }
+        # один запрос на все недостающие годы
+        qs = SpecialDay.objects.filter(reduce(operator.or_, (
+            Q(date__range=(date(year, 1, 1), date(year, 12, 31))) for year in missing
+        )))
+        for day in qs:
+            special_maps[day.date.year][day.date] = day.workdayholidayhours(WORKHOURS)
+        self._years.update(special_maps)
+
+    def index(self, fromdate, todate):
+        self._check_version()
+        index = self._index
+        if index is None or not index.covers(fromdate, todate):
+            first_year, last_year = fromdate.year, todate.year
+            if index is not None:
+                first_year = min(first_year, index.first_year)
+                last_year = max(last_year, index.last_year)
+            years = range(first_year, last_year + 1)
+            self._load_years(years)
+            # словарь специальных дней (день, часов) из производственного календаря
+            special_map = {}
+            for year in years:
+                special_map.update(self._years[year])
+            index = self._index = CalendarIndex(first_year, last_year, special_map)
+        return index
+
+    def totals(self, fromdate, todate):
+        if todate < fromdate:
+            return 0, 0, 0
+        return self.index(fromdate, todate).totals(fromdate, todate)
+
+    def finish_date(self, fromdate, days):
+        # окно поиска расширяется, пока не будет найдено нужное число рабочих дней
+        todate = fromdate
+        while True:
+            todate += timedelta(days=2 * days + 31)
+            finish = self.index(fromdate, todate).finish_date(fromdate, days)
+            if finish:
+                return finish
+
+    def start_date(self, todate, days):
+        fromdate = todate
+        while True:
+            fromdate -= timedelta(days=2 * days + 31)
+            start = self.index(fromdate, todate).start_date(todate, days)
+            if start:
+                return start
+
+    def totals_array(self, fromdates, todates):
+        valid = fromdates <= todates
+        if not valid.any():
+            return np.zeros((3, len(fromdates)), dtype=np.int64)
+        index = self.index(fromdates[valid].min().astype(date), todates[valid].max().astype(date))
+        return index.totals_array(fromdates, todates)
+
+    def reset(self):
+        '''
+        Сброс кэша текущего процесса и, после фиксации транзакции, всех остальных процессов
+        '''
+        self._clear()
+        transaction.on_commit(self._publish)
+
+    def _publish(self):
+        self._clear()
+        self._version = uuid.uuid4().hex
+        cache.set(self.VERSION_KEY, self._version, None)
+
+
+production_calendar = ProductionCalendar()
+
+
 def workdayholidayhours(fromdate, todate):
     '''
     Расчет числа рабочих дней, выходных и рабочих часов в заданных границах
     '''
-    # перечень дней в заданных границах
-    daygenerator = ( fromdate + timedelta(x) for x in range(days(fromdate, todate)) )
-    
-    # словарь специальных дней (день, часов) из производственного календаря
-    qs = SpecialDay.objects.filter(date__range=(fromdate, todate))
-    special_map = { day.date:day.workdayholidayhours(WORKHOURS) for day in qs }
-    
-    # генератор последовательности (день, часов) для перечня дней 
-    dayhours = (
-        # поиск дня в словаре, если нет - проверка на выходной
-        special_map.get(
-            date, 
-            (0, 1, 0) if date.weekday() in WEEKEND else (1, 0, WORKHOURS)
-        ) for date in daygenerator
-    )
+    total_days, total_holidays, total_hours = production_calendar.totals(fromdate, todate)
+    return total_days, total_holidays, total_hours, total_hours * 0.7, total_hours * 0.5  
+
+def workdayholidayhours_array(fromdates, todates):
+    '''
+    Пакетный расчет числа рабочих дней, выходных и рабочих часов
+    для массивов (или списков) начальных и конечных дат интервалов
 
-    # преобразование в список с результатами
-    result_list = list(zip(*dayhours))
+    Возвращает кортеж из трех массивов numpy: рабочих дней, выходных, рабочих часов
+    '''
+    fromdates = np.asarray(fromdates, dtype='datetime64[D]')
+    todates = np.asarray(todates, dtype='datetime64[D]')
+    total_days, total_holidays, total_hours = production_calendar.totals_array(fromdates, todates)
+    return total_days, total_holidays, total_hours
 
-    # итоговый подсчет числа дней и часов
-    total_days = sum(result_list[0])
-    total_holidays = sum(result_list[1])
-    total_hours = sum(result_list[2])
-    return total_days, total_holidays, total_hours, total_hours * 0.7, total_hours * 0.5  
+def workdays_array(fromdates, todates):
+    return workdayholidayhours_array(fromdates, todates)[0]
+
+def holidays_array(fromdates, todates):
+    return workdayholidayhours_array(fromdates, todates)[1]
+
+def workhours_array(fromdates, todates):
+    return workdayholidayhours_array(fromdates, todates)[2]
 
 def workdays(fromdate, todate):
     return workdayholidayhours(fromdate, todate)[0]
@@ -93,20 +202,116 @@ def workhours(fromdate, todate):
     return workdayholidayhours(fromdate, todate)[2]
 
 
+def add_workdays(day, count):
+    '''
+    Дата, отстоящая от заданной на count рабочих дней (вперед или назад при count < 0)
+    '''
+    if count > 0:
+        return production_calendar.finish_date(day + timedelta(days=1), count)
+    elif count < 0:
+        return production_calendar.start_date(day - timedelta(days=1), -count)
+    return day
+
+def finish_date(fromdate, days):
+    '''
+    Дата окончания работ продолжительностью days рабочих дней, начатых в fromdate
+    '''
+    if days <= 0:
+        return None
+    return production_calendar.finish_date(fromdate, days)
+
+def finish_date_for_volume(fromdate, volume, load):
+    '''
+    Дата окончания работ объемом volume чел.дн. при заданном проценте загрузки
+    '''
+    try:
+        # округление для исключения погрешности вычислений с плавающей точкой
+        days = math.ceil(round(volume * 100 / load, 6))
+    except (TypeError, ZeroDivisionError):
+        return None
+    return finish_date(fromdate, days)
+
+
+def holiday_candidates(year, holiday_names):
+    '''
+    Генератор специальных дней года по справочнику праздников:
+    сокращенные дни перед началом праздников и праздничные дни
+    '''
+    for hd in holiday_names:
+        # установка сокращенного дня перед началом праздника, если не выходной
+        short_date = date(year, hd.month, hd.day) - timedelta(1)
+        if not short_date.weekday() in WEEKEND:
+            yield SpecialDay(date=short_date, daytype=SpecialDay.SHORTENED)
+
+        # установка праздничных дней
+        count = hd.count
+        n = 0
+        while n < count:
+            holiday_date = date(year, hd.month, hd.day) + timedelta(n)
+            # смещение праздника на первый нерабочий день, кроме января
+            if holiday_date.weekday() in WEEKEND and not holiday_date.month == 1:
+                count += 1
+                n += 1
+                continue
+            yield SpecialDay(date=holiday_date, daytype=SpecialDay.HOLIDAY, dayname=hd)
+            n += 1
+
+@transaction.atomic
+def generate_holidays(first_year, last_year):
+    '''
+    Заполнение календаря праздниками за диапазон лет
+
+    Уже установленные дни не изменяются, новые дни записываются одной вставкой на каждый год.
+    Результат - список кортежей: год, добавлено дней, пропущено дней
+    '''
+    holiday_names = list(HolidayName.objects.all())
+    # уже установленные дни диапазона, включая канун первого года и начало следующего за последним
+    taken = set(SpecialDay.objects.filter(
+        date__range=(date(first_year - 1, 12, 1), date(last_year + 1, 1, 31))
+    ).values_list('date', flat=True))
+
+    result = []
+    for year in range(first_year, last_year + 1):
+        rows = []
+        skipped = 0
+        for day in holiday_candidates(year, holiday_names):
+            if day.date in taken:
+                skipped += 1
+                continue
+            taken.add(day.date)
+            rows.append(day)
+        SpecialDay.objects.bulk_create(rows)
+        result.append((year, len(rows), skipped))
+
+    # массовая вставка не вызывает сигналов сохранения
+    production_calendar.reset()
+    return result
+
+
 # Объем работы в человекоднях при заданной продолжительности и проценте загрузки
 def volume(workdays, load):
     return workdays * load / 100
 
+# Матрица статистики производственного календаря за диапазон лет
+# результат - три массива со столбцами (календарных, рабочих, выходных дней, часов, часов 70%, часов 50%):
+# по месяцам (12 строк на год), по кварталам (4 строки на год) и по годам
+def standards_matrix(first_year, last_year):
+    index = production_calendar.index(date(first_year, 1, 1), date(last_year, 12, 31))
+    days, workday, holiday, hours = index.month_totals(first_year, last_year)
+
+    months = np.column_stack((days, workday, holiday, hours, hours * 0.7, hours * 0.5))
+    quarters = months.reshape(-1, 3, months.shape[1]).sum(axis=1)
+    years = months.reshape(-1, 12, months.shape[1]).sum(axis=1)
+    return months, quarters, years
+
 # Формирование набора данных статистики производственного календаря 
 def standards_report(year):
-    # расчет диапазонов дат для каждого месяца и квартала
-    m_ranges = ( (m[1], date(year, m[0], 1), date(year, m[0], 1) + monthdelta(1) - timedelta(days=1)) for m in MONTHS )
-    q_ranges = ( (q[1], date(year, q[0], 1), date(year, q[0], 1) + monthdelta(3) - timedelta(days=1)) for q in QUARTES )
-    y_range = ( ('Год', date(year, 1, 1), date(year+1, 1, 1) - timedelta(days=1)), )
+    months, quarters, years = standards_matrix(year, year)
+    names = it.chain((m[1] for m in MONTHS), (q[1] for q in QUARTES), ('Год',))
 
     return (
         {
-            'name': r[0],
-            'stat': (days(r[1], r[2]), *workdayholidayhours(r[1], r[2]))
-        } for r in it.chain(m_ranges, q_ranges, y_range)
+            'name': name,
+            'stat': stat
+        } for name, stat in zip(names, np.vstack((months, quarters, years)).tolist())
     )